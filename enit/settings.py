@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "environmental_data.instrumentation.QueryStatsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -86,6 +87,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Parallel importers write concurrently; take the write lock up front
+        # and wait for it instead of failing with "database is locked".
+        "OPTIONS": {"timeout": 60, "transaction_mode": "IMMEDIATE"},
     }
 }
 
@@ -136,22 +140,73 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 
+# Memory-mapped columnar snapshot of the historical records, regenerated
+# after every import and read by the analytical endpoints.
+HISTORICAL_SNAPSHOT_DIR = BASE_DIR / "data" / "snapshot"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Redis database of the Celery broker and results
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
 # Celery configurations
-CELERY_BROKER_URL = "redis://localhost:6379/0"  # URL for the Redis broker
-CELERY_RESULT_BACKEND = "redis://localhost:6379/0"  # Store results in Redis
+CELERY_BROKER_URL = REDIS_URL  # URL for the Redis broker
+CELERY_RESULT_BACKEND = REDIS_URL  # Store results in Redis
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
 
-# settings.py
-CELERY_BROKER_URL = "redis://localhost:6379/0"
-CELERY_RESULT_BACKEND = "redis://localhost:6379/0"
+# Cache shared by the web and Celery workers. It lives in its own Redis
+# database so flushing it leaves the Celery queues and results alone. Set
+# CACHE_BACKEND=locmem to keep it in process memory instead; that is only
+# for single-process development, as imports and workers in other
+# processes then cannot invalidate cached responses (environmental_data.E001).
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/1")
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "redis")
+CACHES = {
+    "default": (
+        {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+            "KEY_PREFIX": "enit",
+        }
+        if CACHE_BACKEND == "redis"
+        else {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+    )
+}
+
+# Cache alias and lifetime of the historical API responses. Cached responses
+# are invalidated by bumping the dataset generation, the TTL only bounds how
+# long entries of old generations linger.
+RESPONSE_CACHE_ALIAS = os.getenv("RESPONSE_CACHE_ALIAS", "default")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+
+# Default and maximum page size of the keyset-paginated historical API.
+# Unpaginated requests matching more values than the maximum get the first
+# page of that size.
+HISTORICAL_PAGE_SIZE = int(os.getenv("HISTORICAL_PAGE_SIZE", "1000"))
+HISTORICAL_PAGE_SIZE_MAX = int(os.getenv("HISTORICAL_PAGE_SIZE_MAX", "10000"))
+# Substance of the historical records API when the request names none; its
+# responses have no substance level.
+HISTORICAL_DEFAULT_SUBSTANCE = os.getenv("HISTORICAL_DEFAULT_SUBSTANCE", "CO2")
+
+# Default and maximum number of points of a downsampled realtime series, and
+# the time range covered when a request gives no start.
+REALTIME_SERIES_POINTS = int(os.getenv("REALTIME_SERIES_POINTS", "1000"))
+REALTIME_SERIES_MAX_POINTS = int(os.getenv("REALTIME_SERIES_MAX_POINTS", "10000"))
+REALTIME_SERIES_DEFAULT_HOURS = int(os.getenv("REALTIME_SERIES_DEFAULT_HOURS", "24"))
+
+# Send the SQL query count and time of each request in the X-Query-Count and
+# Server-Timing response headers. They are always logged.
+QUERY_STATS_HEADER = os.getenv("QUERY_STATS_HEADER", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
 
 # Add debug toolbar
 INSTALLED_APPS += ["debug_toolbar"]
@@ -159,13 +214,111 @@ MIDDLEWARE += ["debug_toolbar.middleware.DebugToolbarMiddleware"]
 
 INTERNAL_IPS = ["127.0.0.1"]
 
+# Seconds between runs of the adaptive realtime polling scheduler. Each run
+# only polls the zones whose next update is expected by then.
+REALTIME_SCHEDULER_TICK = float(os.getenv("REALTIME_SCHEDULER_TICK", "60"))
+
 CELERY_BEAT_SCHEDULE = {
-    "fetch-realtime-emissions-every-hour": {
-        "task": "environmental_data.tasks.fetch_realtime_emissions",
-        "schedule": 86400.0,
+    "poll-due-realtime-zones": {
+        "task": "environmental_data.tasks.poll_due_zones",
+        "schedule": REALTIME_SCHEDULER_TICK,
     },
 }
 
+# Maximum number of Country/Sector/Substance ids cached per process and key.
+DIMENSION_CACHE_SIZE = int(os.getenv("DIMENSION_CACHE_SIZE", "10000"))
+
+# Zones polled by fetch_realtime_emissions and how many requests it keeps
+# in flight at once.
+REALTIME_ZONES = [
+    zone.strip()
+    for zone in os.getenv("REALTIME_ZONES", "DE,FR,GB,ES,IT,PL,NL,BE").split(",")
+    if zone.strip()
+]
+REALTIME_FETCH_CONCURRENCY = int(os.getenv("REALTIME_FETCH_CONCURRENCY", "16"))
+
+# Write-behind mode: polling tasks push readings into REALTIME_BUFFER and
+# flush_realtime_buffer stores them in batches every flush interval.
+REALTIME_WRITE_BEHIND = os.getenv("REALTIME_WRITE_BEHIND", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+REALTIME_BUFFER = {
+    "BACKEND": "environmental_data.buffer.RedisBuffer",
+    "OPTIONS": {"url": REDIS_URL},
+}
+REALTIME_BUFFER_BATCH_SIZE = int(os.getenv("REALTIME_BUFFER_BATCH_SIZE", "5000"))
+REALTIME_BUFFER_FLUSH_INTERVAL = float(
+    os.getenv("REALTIME_BUFFER_FLUSH_INTERVAL", "60")
+)
+# Seconds after which the lock of a flush that died is released.
+REALTIME_BUFFER_FLUSH_TIMEOUT = int(os.getenv("REALTIME_BUFFER_FLUSH_TIMEOUT", "300"))
+if REALTIME_WRITE_BEHIND:
+    CELERY_BEAT_SCHEDULE["flush-realtime-buffer"] = {
+        "task": "environmental_data.tasks.flush_realtime_buffer",
+        "schedule": REALTIME_BUFFER_FLUSH_INTERVAL,
+    }
+
+# Learned polling cadence of the realtime zones, in seconds. New zones start
+# from the median gap of their readings within REALTIME_CADENCE_WINDOW, or
+# the default. Zones are polled REALTIME_POLL_DELAY after their expected
+# update plus a jitter of up to REALTIME_POLL_JITTER times the interval.
+# Polls without a new reading back off from the minimum up to the maximum.
+REALTIME_POLL_DEFAULT_INTERVAL = float(
+    os.getenv("REALTIME_POLL_DEFAULT_INTERVAL", "3600")
+)
+REALTIME_POLL_MIN_INTERVAL = float(os.getenv("REALTIME_POLL_MIN_INTERVAL", "300"))
+REALTIME_POLL_MAX_INTERVAL = float(os.getenv("REALTIME_POLL_MAX_INTERVAL", "21600"))
+REALTIME_POLL_DELAY = float(os.getenv("REALTIME_POLL_DELAY", "60"))
+REALTIME_POLL_JITTER = float(os.getenv("REALTIME_POLL_JITTER", "0.1"))
+REALTIME_CADENCE_WINDOW = int(os.getenv("REALTIME_CADENCE_WINDOW", str(2 * 86400)))
+
+# HTTP client shared by the ElectricityMap tasks of a worker process.
+ELECTRICITY_MAP_POOL_SIZE = int(
+    os.getenv("ELECTRICITY_MAP_POOL_SIZE", str(REALTIME_FETCH_CONCURRENCY))
+)
+ELECTRICITY_MAP_CONNECT_TIMEOUT = float(
+    os.getenv("ELECTRICITY_MAP_CONNECT_TIMEOUT", "3.05")
+)
+ELECTRICITY_MAP_READ_TIMEOUT = float(os.getenv("ELECTRICITY_MAP_READ_TIMEOUT", "10"))
+# Upper bound in seconds for one API call including its retries, and the
+# retry policy: up to ELECTRICITY_MAP_MAX_RETRIES retries with exponential
+# backoff, while retries stay below ELECTRICITY_MAP_RETRY_BUDGET times the
+# calls (plus ELECTRICITY_MAP_RETRY_BUDGET_MIN) per breaker window.
+ELECTRICITY_MAP_CALL_DEADLINE = float(os.getenv("ELECTRICITY_MAP_CALL_DEADLINE", "20"))
+ELECTRICITY_MAP_MAX_RETRIES = int(os.getenv("ELECTRICITY_MAP_MAX_RETRIES", "2"))
+ELECTRICITY_MAP_RETRY_BACKOFF = float(os.getenv("ELECTRICITY_MAP_RETRY_BACKOFF", "0.5"))
+ELECTRICITY_MAP_RETRY_BUDGET = float(os.getenv("ELECTRICITY_MAP_RETRY_BUDGET", "0.2"))
+ELECTRICITY_MAP_RETRY_BUDGET_MIN = int(
+    os.getenv("ELECTRICITY_MAP_RETRY_BUDGET_MIN", "10")
+)
+# The circuit breaker opens for ELECTRICITY_MAP_BREAKER_COOLDOWN seconds
+# after ELECTRICITY_MAP_BREAKER_THRESHOLD failures within the window.
+ELECTRICITY_MAP_BREAKER_THRESHOLD = int(
+    os.getenv("ELECTRICITY_MAP_BREAKER_THRESHOLD", "5")
+)
+ELECTRICITY_MAP_BREAKER_WINDOW = float(
+    os.getenv("ELECTRICITY_MAP_BREAKER_WINDOW", "60")
+)
+ELECTRICITY_MAP_BREAKER_COOLDOWN = float(
+    os.getenv("ELECTRICITY_MAP_BREAKER_COOLDOWN", "30")
+)
+# Seconds the datetime of the last stored reading of a zone is remembered.
+LAST_READING_TTL = int(os.getenv("LAST_READING_TTL", "86400"))
+# Seconds an upstream response stays cached, per endpoint.
+ELECTRICITY_MAP_CACHE_TTL = {
+    "carbon-intensity/latest": int(os.getenv("ELECTRICITY_MAP_LATEST_TTL", "300")),
+    "carbon-intensity/history": int(os.getenv("ELECTRICITY_MAP_HISTORY_TTL", "900")),
+}
+
+# Historical backfill: window size per upstream request, shared request
+# rate (token bucket refill per second and burst size) and retry limit.
+BACKFILL_WINDOW_HOURS = int(os.getenv("BACKFILL_WINDOW_HOURS", "240"))
+BACKFILL_RATE_PER_SECOND = float(os.getenv("BACKFILL_RATE_PER_SECOND", "1"))
+BACKFILL_BURST = float(os.getenv("BACKFILL_BURST", "5"))
+BACKFILL_MAX_ATTEMPTS = int(os.getenv("BACKFILL_MAX_ATTEMPTS", "5"))
+
 CORS_ALLOW_ALL_ORIGINS = True
 
 INSTALLED_APPS += ["corsheaders"]
@@ -0,0 +1,13 @@
+"""
+Settings for running the test suite without a Redis server.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+# Tests only read the cache in the process that changed the data.
+SILENCED_SYSTEM_CHECKS = ["environmental_data.E001"]
+
+# Worker processes of parallel imports open their own connections, which
+# cannot see an in-memory test database.
+DATABASES["default"]["TEST"] = {"NAME": BASE_DIR / "test_db.sqlite3"}  # noqa: F405
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class EnvironmentalDataConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "environmental_data"
+
+    def ready(self):
+        from . import checks  # noqa: F401 - system checks
+        from . import (  # noqa: F401 - signals
+            catalog,
+            coverage,
+            dimensions,
+            instrumentation,
+            response_cache,
+            rollup,
+        )
@@ -0,0 +1,118 @@
+"""
+Write-behind buffer for realtime readings.
+
+With ``REALTIME_WRITE_BEHIND`` enabled the polling tasks push readings into
+the buffer instead of writing them, and ``flush_realtime_buffer`` drains it
+into the database in large batches.
+
+A flush first claims the buffered readings by atomically renaming the list,
+so readings pushed while it runs go to a new list. The claimed list is only
+deleted after its readings are stored. A flush that dies leaves it in
+place and the next flush delivers it again; the unique constraint on
+(country, substance, timestamp) drops the duplicates.
+
+The backend is configured like ``CACHES``::
+
+    REALTIME_BUFFER = {
+        "BACKEND": "environmental_data.buffer.RedisBuffer",
+        "OPTIONS": {"url": "redis://localhost:6379/0"},
+    }
+"""
+
+import json
+import threading
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+BUFFER_KEY = "enit:realtime-buffer"
+FLUSH_LOCK_KEY = "realtime-buffer:flush-lock"
+METRICS_KEY = "realtime-buffer:last-flush"
+
+_buffers = {}
+
+
+class RedisBuffer:
+    """
+    Buffer kept in a Redis list shared by all workers.
+    """
+
+    def __init__(self, url: str = None, key: str = BUFFER_KEY):
+        self.client = redis.Redis.from_url(url or settings.REDIS_URL)
+        self.key = key
+        self.claimed_key = f"{key}:claimed"
+
+    def push(self, readings: list[dict]) -> None:
+        if readings:
+            self.client.rpush(self.key, *[json.dumps(r) for r in readings])
+
+    def claim(self) -> list[dict]:
+        """
+        Return the claimed readings, claiming the buffered ones if no
+        earlier flush left any behind.
+        """
+        try:
+            self.client.renamenx(self.key, self.claimed_key)
+        except redis.ResponseError:
+            pass  # Nothing buffered.
+        return [
+            json.loads(item) for item in self.client.lrange(self.claimed_key, 0, -1)
+        ]
+
+    def ack(self) -> None:
+        self.client.delete(self.claimed_key)
+
+    def depth(self) -> int:
+        with self.client.pipeline() as pipe:
+            pipe.llen(self.key)
+            pipe.llen(self.claimed_key)
+            return sum(pipe.execute())
+
+
+class MemoryBuffer:
+    """
+    Process-local buffer with the same semantics, for tests and single
+    process setups.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.claimed = []
+        self._lock = threading.Lock()
+
+    def push(self, readings: list[dict]) -> None:
+        with self._lock:
+            self.items.extend(json.loads(json.dumps(r)) for r in readings)
+
+    def claim(self) -> list[dict]:
+        with self._lock:
+            if not self.claimed:
+                self.claimed, self.items = self.items, []
+            return list(self.claimed)
+
+    def ack(self) -> None:
+        with self._lock:
+            self.claimed = []
+
+    def depth(self) -> int:
+        return len(self.items) + len(self.claimed)
+
+
+def get_buffer():
+    """
+    Return the configured buffer, created once per process and setting.
+    """
+    config = settings.REALTIME_BUFFER
+    key = (config["BACKEND"], tuple(sorted(config.get("OPTIONS", {}).items())))
+    if key not in _buffers:
+        _buffers[key] = import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+    return _buffers[key]
+
+
+def buffer_metrics() -> dict:
+    """
+    Return the current buffer depth and the metrics of the last flush.
+    """
+    return {"depth": get_buffer().depth(), "last_flush": cache.get(METRICS_KEY)}
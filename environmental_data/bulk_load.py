@@ -0,0 +1,129 @@
+"""
+SQLite bulk-load mode for ``import_environmental_data --fast``.
+
+While the mode is active the database runs in WAL mode with relaxed
+synchronous writes and the secondary indexes of the loaded tables are
+dropped. Every dropped index is recorded in ``DroppedIndex`` in the same
+transaction that drops it, so if the process dies before the indexes are
+rebuilt, ``restore_dropped_indexes`` recreates them on the next run.
+"""
+
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.transaction import TransactionManagementError
+
+from .models import DroppedIndex
+
+FAST_PRAGMAS = {
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": -256000,  # 256 MB
+}
+
+
+def is_sqlite() -> bool:
+    return connection.vendor == "sqlite"
+
+
+def _pragma(name: str, value=None):
+    with connection.cursor() as cursor:
+        if value is None:
+            cursor.execute(f"PRAGMA {name}")
+        else:
+            cursor.execute(f"PRAGMA {name} = {value}")
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def apply_fast_pragmas() -> None:
+    """
+    Relax durability on the current connection. Connection-level settings
+    die with the connection, so worker processes call this for their own.
+    """
+    for name, value in FAST_PRAGMAS.items():
+        _pragma(name, value)
+
+
+def secondary_indexes(table: str) -> list[tuple[str, str]]:
+    """
+    Return ``(name, sql)`` for the non-unique indexes on ``table``. Unique
+    indexes are kept: they enforce the natural key the upsert relies on.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL "
+            "AND sql NOT LIKE 'CREATE UNIQUE INDEX%%'",
+            [table],
+        )
+        return cursor.fetchall()
+
+
+def drop_secondary_indexes(tables: list[str]) -> None:
+    with transaction.atomic():
+        for table in tables:
+            for name, sql in secondary_indexes(table):
+                DroppedIndex.objects.update_or_create(
+                    name=name, defaults={"table": table, "sql": sql}
+                )
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP INDEX "{name}"')
+
+
+def restore_dropped_indexes() -> list[str]:
+    """
+    Recreate every index recorded in ``DroppedIndex`` and refresh the
+    planner statistics. Returns the names of the rebuilt indexes.
+    """
+    if not is_sqlite():
+        return []
+
+    with transaction.atomic():
+        dropped = list(DroppedIndex.objects.all())
+        for index in dropped:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    index.sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1)
+                )
+        DroppedIndex.objects.filter(pk__in=[index.pk for index in dropped]).delete()
+
+    if dropped:
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+    return [index.name for index in dropped]
+
+
+@contextmanager
+def fast_sqlite_mode(tables: list[str]):
+    """
+    Switch the database into bulk-load mode for the duration of the block
+    and restore the previous journal mode, synchronous level and indexes
+    on the way out, whether or not the block raised.
+
+    Does nothing on databases other than SQLite. Journal mode and
+    synchronous level cannot change inside a transaction, so the block
+    must run in autocommit mode.
+    """
+    if not is_sqlite():
+        yield
+        return
+
+    if connection.in_atomic_block:
+        raise TransactionManagementError(
+            "The SQLite bulk-load mode cannot be used inside a transaction."
+        )
+
+    restore_dropped_indexes()
+    previous = {name: _pragma(name) for name in FAST_PRAGMAS}
+    previous_journal_mode = _pragma("journal_mode")
+    try:
+        _pragma("journal_mode", "WAL")
+        apply_fast_pragmas()
+        drop_secondary_indexes(tables)
+        yield
+    finally:
+        restore_dropped_indexes()
+        for name, value in previous.items():
+            _pragma(name, value)
+        _pragma("journal_mode", previous_journal_mode)
@@ -0,0 +1,127 @@
+"""
+Preserialized catalog of the dimension tables.
+
+The country, sector and substance lists, and the catalog with the ids and
+codes of all three, are encoded to JSON and gzipped once and served as
+bytes from process memory. Creating, renaming or deleting a dimension row
+bumps the catalog version in the shared cache, so every process rebuilds
+its bytes on the next request; until then a request costs one cache read
+and no query.
+"""
+
+import gzip
+import json
+import re
+import threading
+from typing import NamedTuple
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+from .models import Country, Sector, Substance
+from .response_cache import bump_counter, counter
+
+VERSION_KEY = "catalog-version"
+
+accepts_gzip = re.compile(r"\bgzip\b").search
+
+
+def catalog_data() -> dict:
+    return {
+        "countries": list(
+            Country.objects.order_by("name").values("id", "name", "code")
+        ),
+        "sectors": list(Sector.objects.order_by("name").values("id", "name")),
+        "substances": list(Substance.objects.order_by("name").values("id", "name")),
+    }
+
+
+BUILDERS = {
+    "countries": lambda: list(Country.objects.order_by("name").values("name")),
+    "sectors": lambda: list(Sector.objects.order_by("name").values("name")),
+    "substances": lambda: list(Substance.objects.order_by("name").values("name")),
+    "catalog": catalog_data,
+}
+
+
+class Payload(NamedTuple):
+    version: int
+    etag: str
+    body: bytes
+    gzip_etag: str
+    gzipped: bytes
+
+
+_payloads: dict[str, Payload] = {}
+_lock = threading.Lock()
+
+
+def version() -> int:
+    """
+    Return the current catalog version.
+    """
+    return counter(VERSION_KEY)
+
+
+def bump_version() -> None:
+    """
+    Have every process rebuild its catalog once the current transaction
+    commits.
+    """
+    bump_counter(VERSION_KEY)
+
+
+def payload(name: str) -> Payload:
+    """
+    Return the encoded ``name`` list of ``BUILDERS`` for the current
+    version, building it if this process has an older one.
+    """
+    current = version()
+    cached = _payloads.get(name)
+    if cached is not None and cached.version == current:
+        return cached
+
+    body = json.dumps(BUILDERS[name](), separators=(",", ":")).encode()
+    built = Payload(
+        version=current,
+        etag=f'"{name}-{current}"',
+        body=body,
+        gzip_etag=f'"{name}-{current}-gzip"',
+        gzipped=gzip.compress(body, mtime=0),
+    )
+    with _lock:
+        _payloads[name] = built
+    return built
+
+
+def catalog_response(request: HttpRequest, name: str) -> HttpResponse:
+    """
+    Serve the ``name`` payload, gzipped if the client accepts it, or a 304
+    if the client already has the current version. Each encoding has its
+    own ETag, so caches never pair a 304 with the other representation.
+    """
+    data = payload(name)
+    gzipped = bool(accepts_gzip(request.headers.get("Accept-Encoding", "")))
+    etag = data.gzip_etag if gzipped else data.etag
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if gzipped:
+            response = HttpResponse(data.gzipped, content_type="application/json")
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(data.body, content_type="application/json")
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept-Encoding"])
+    return response
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Sector)
+@receiver(post_save, sender=Substance)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Sector)
+@receiver(post_delete, sender=Substance)
+def invalidate_catalog(sender, **kwargs):
+    bump_version()
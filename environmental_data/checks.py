@@ -0,0 +1,29 @@
+"""
+System checks of the cache configuration.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Warning, register
+
+
+@register()
+def check_response_cache(app_configs, **kwargs):
+    """
+    The dataset generation and catalog version live in the response cache.
+    With a process-local backend each process has its own counters, so
+    imports and ingestion in one process never invalidate the responses,
+    ETags, catalog and snapshot served by another.
+    """
+    if not isinstance(caches[settings.RESPONSE_CACHE_ALIAS], LocMemCache):
+        return []
+    message = "The response cache is local to each process."
+    hint = (
+        "Changes made by imports and Celery workers are not seen by the web "
+        "workers. Use a shared backend such as Redis outside of single-process "
+        "development."
+    )
+    if settings.DEBUG:
+        return [Warning(message, hint=hint, id="environmental_data.W001")]
+    return [Error(message, hint=hint, id="environmental_data.E001")]
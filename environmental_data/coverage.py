@@ -0,0 +1,112 @@
+"""
+Maintenance and lookups of the ``HistoricalCoverage`` index.
+
+The importer refreshes the coverage of the countries it wrote in the same
+transaction as the records; records saved or deleted one at a time refresh
+theirs through model signals. The index is small enough that resolving the
+most recent year, or finding that a filter matches nothing, costs a lookup
+in it instead of a scan of the records.
+"""
+
+from typing import Iterable, Optional
+
+from django.db.models import Count, Max, Min
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import HistoricalCoverage, HistoricalEnvironmentalRecord
+
+
+def refresh_coverage(substance_id: int, country_ids: Iterable[int]) -> int:
+    """
+    Recompute the coverage of ``substance_id`` for every sector of
+    ``country_ids``. Entries whose records are all gone are removed.
+
+    Returns:
+        int: Number of entries written.
+    """
+    country_ids = set(country_ids)
+    if not country_ids:
+        return 0
+
+    coverage = (
+        HistoricalEnvironmentalRecord.objects.filter(
+            substance_id=substance_id, country_id__in=country_ids
+        )
+        .order_by()
+        .values_list("country_id", "sector_id")
+        .annotate(first_year=Min("year"), last_year=Max("year"), rows=Count("id"))
+    )
+    entries = [
+        HistoricalCoverage(
+            country_id=country_id,
+            sector_id=sector_id,
+            substance_id=substance_id,
+            first_year=first_year,
+            last_year=last_year,
+            rows=rows,
+        )
+        for country_id, sector_id, first_year, last_year, rows in coverage
+    ]
+    HistoricalCoverage.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=["country", "sector", "substance"],
+        update_fields=["first_year", "last_year", "rows"],
+    )
+
+    current = {(entry.country_id, entry.sector_id) for entry in entries}
+    stale = [
+        pk
+        for pk, country_id, sector_id in HistoricalCoverage.objects.filter(
+            substance_id=substance_id, country_id__in=country_ids
+        ).values_list("pk", "country_id", "sector_id")
+        if (country_id, sector_id) not in current
+    ]
+    if stale:
+        HistoricalCoverage.objects.filter(pk__in=stale).delete()
+    return len(entries)
+
+
+def most_recent_year(queryset=None) -> Optional[int]:
+    """
+    Return the most recent year covered by the coverage entries in
+    ``queryset`` (all of them by default), or ``None`` if there are none.
+    """
+    if queryset is None:
+        queryset = HistoricalCoverage.objects.all()
+    return queryset.aggregate(year=Max("last_year"))["year"]
+
+
+def covering(country_ids=None, sector_ids=None, substance=None):
+    """
+    Return the coverage entries of the given country and sector ids
+    (``None`` for any) and substance name (case-insensitive).
+    """
+    coverage = HistoricalCoverage.objects.order_by()
+    if substance:
+        coverage = coverage.filter(substance__name__iexact=substance)
+    if country_ids is not None:
+        coverage = coverage.filter(country_id__in=country_ids)
+    if sector_ids is not None:
+        coverage = coverage.filter(sector_id__in=sector_ids)
+    return coverage
+
+
+def is_covered(
+    country_ids=None, sector_ids=None, start_year=None, end_year=None, substance=None
+):
+    """
+    Return whether any record can match the given country and sector ids
+    (``None`` for any), year range and substance name (case-insensitive).
+    """
+    coverage = covering(country_ids, sector_ids, substance)
+    if start_year is not None and end_year is not None:
+        coverage = coverage.filter(first_year__lte=end_year, last_year__gte=start_year)
+    return coverage.exists()
+
+
+@receiver(post_save, sender=HistoricalEnvironmentalRecord)
+@receiver(post_delete, sender=HistoricalEnvironmentalRecord)
+def refresh_record_coverage(sender, instance, **kwargs):
+    refresh_coverage(instance.substance_id, [instance.country_id])
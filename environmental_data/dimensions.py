@@ -0,0 +1,173 @@
+"""
+Process-local resolution of Country, Sector and Substance keys to ids.
+
+Ingestion, the importer and the views look dimensions up through the
+caches below instead of calling ``get_or_create`` per record. Each cache is
+a bounded LRU map from a natural key (country code, sector name, ...) to the
+primary key. Missing dimensions are created in bulk.
+
+Entries are cleared by model signals when a dimension is saved or deleted.
+Those only reach the process that made the change, so every lookup also
+compares the shared catalog version, which any dimension change bumps,
+with the one the entries were cached under and drops them if it moved.
+New ids are only cached once the transaction that created them commits, so
+a rolled-back import cannot leave ids of rows that do not exist.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import catalog
+from .models import Country, Sector, Substance
+from .response_cache import bump_generation
+
+
+class DimensionCache:
+    """
+    Bounded LRU cache from ``key_field`` values of ``model`` to ids.
+    """
+
+    def __init__(self, model, key_field: str, maxsize: Optional[int] = None):
+        self.model = model
+        self.key_field = key_field
+        self.maxsize = maxsize
+        self._ids = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _check_version(self) -> None:
+        current = catalog.version()
+        with self._lock:
+            if current != self._version:
+                self._ids.clear()
+                self._version = current
+
+    def _adopt_version(self, previous: int, current: int) -> None:
+        with self._lock:
+            if self._version == previous:
+                self._version = current
+
+    def _store(self, ids: dict) -> None:
+        maxsize = self.maxsize or settings.DIMENSION_CACHE_SIZE
+        with self._lock:
+            self._ids.update(ids)
+            while len(self._ids) > maxsize:
+                self._ids.popitem(last=False)
+
+    def _query(self, keys: list) -> dict:
+        return dict(
+            self.model.objects.filter(**{f"{self.key_field}__in": keys}).values_list(
+                self.key_field, "id"
+            )
+        )
+
+    def get_many(
+        self,
+        keys: Iterable,
+        defaults: Optional[dict] = None,
+        create: bool = True,
+    ) -> dict:
+        """
+        Resolve ``keys`` to ids, creating the missing rows in bulk.
+
+        Args:
+            keys: Natural keys to resolve.
+            defaults (dict, optional): Extra field values per key for rows
+                that have to be created.
+            create (bool): Create missing rows. Keys that cannot be resolved
+                are left out of the result.
+
+        Returns:
+            dict: Id per resolved key.
+        """
+        self._check_version()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._ids:
+                    self._ids.move_to_end(key)
+                    found[key] = self._ids[key]
+                else:
+                    missing.append(key)
+
+        if not missing:
+            return found
+
+        ids = self._query(missing)
+        to_create = [key for key in missing if key not in ids]
+        if create and to_create:
+            defaults = defaults or {}
+            self.model.objects.bulk_create(
+                [
+                    self.model(**{self.key_field: key, **defaults.get(key, {})})
+                    for key in to_create
+                ],
+                ignore_conflicts=True,
+            )
+            ids.update(self._query(to_create))
+            bump_generation()
+            catalog.bump_version()
+            transaction.on_commit(adopt_version)
+
+        transaction.on_commit(lambda: self._store(ids))
+        found.update(ids)
+        return found
+
+    def get(self, key, defaults: Optional[dict] = None, create: bool = True):
+        """
+        Resolve a single key, returning ``None`` if it cannot be resolved.
+        """
+        return self.get_many([key], {key: defaults or {}}, create).get(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+
+countries = DimensionCache(Country, "code")
+countries_by_name = DimensionCache(Country, "name")
+sectors = DimensionCache(Sector, "name")
+substances = DimensionCache(Substance, "name")
+
+CACHES_BY_MODEL = {
+    Country: [countries, countries_by_name],
+    Sector: [sectors],
+    Substance: [substances],
+}
+
+
+def adopt_version() -> None:
+    """
+    Keep the entries of every cache across a version bump made by this
+    process creating dimensions, which leaves the cached ids valid. Runs
+    right after the bump, so the version it moved from is one less; if
+    another process bumped in between, the caches are cleared as usual.
+    """
+    current = catalog.version()
+    for caches in CACHES_BY_MODEL.values():
+        for cache in caches:
+            cache._adopt_version(current - 1, current)
+
+
+def clear_all() -> None:
+    for caches in CACHES_BY_MODEL.values():
+        for cache in caches:
+            cache.clear()
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Sector)
+@receiver(post_save, sender=Substance)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Sector)
+@receiver(post_delete, sender=Substance)
+def invalidate_dimension_cache(sender, **kwargs):
+    for cache in CACHES_BY_MODEL[sender]:
+        cache.clear()
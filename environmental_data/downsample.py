@@ -0,0 +1,85 @@
+"""
+Shape-preserving downsampling of time series for charts.
+
+Both methods return the indices of the points to keep, in order, and always
+keep the first and last point.
+
+``lttb`` (Largest-Triangle-Three-Buckets) keeps from every bucket the point
+that forms the largest triangle with the point kept before it and the
+average of the next bucket, which follows the visual shape of the series.
+``minmax`` keeps the lowest and highest point of every bucket, so no peak
+is lost.
+"""
+
+import numpy as np
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Select ``threshold`` points of the series ``(x, y)`` with LTTB.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1])
+
+    # threshold - 2 buckets between the first and the last point.
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+
+    a = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_stop = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_stop = n - 1, n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:stop] - y[a])
+            - (x[a] - x[start:stop]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Select at most ``threshold`` points of ``y`` by keeping the minimum and
+    the maximum of equal buckets, plus the first and last point.
+    """
+    n = len(y)
+    buckets = (threshold - 2) // 2
+    if threshold >= n:
+        return np.arange(n)
+    if buckets < 1:
+        return np.array([0, n - 1])
+
+    bucket = np.arange(n) * buckets // n
+    starts = np.searchsorted(bucket, np.arange(buckets))
+
+    def first_of_bucket(mask):
+        indices = np.flatnonzero(mask)
+        _, first = np.unique(bucket[indices], return_index=True)
+        return indices[first]
+
+    lows = first_of_bucket(y == np.minimum.reduceat(y, starts)[bucket])
+    highs = first_of_bucket(y == np.maximum.reduceat(y, starts)[bucket])
+    return np.unique(np.concatenate([lows, highs, [0, n - 1]]))
+
+
+def downsample(x: np.ndarray, y: np.ndarray, points: int, method: str = "lttb"):
+    """
+    Return the indices of about ``points`` points of ``(x, y)`` chosen by
+    ``method``, one of ``METHODS``.
+    """
+    if method == "minmax":
+        return minmax(y, points)
+    return lttb(x, y, points)
@@ -0,0 +1,203 @@
+"""
+Shared HTTP client for the ElectricityMap API.
+
+Every worker process keeps one ``requests.Session`` so calls reuse pooled
+keep-alive connections instead of paying for a new TLS handshake each time.
+The session is recreated after a fork, because connection pools must not be
+shared between processes.
+
+``get_json`` puts a read-through cache in front of the API. Successful
+responses are kept in the shared cache for ``ELECTRICITY_MAP_CACHE_TTL``
+seconds, so tasks of all workers polling the same zone within that time
+share one upstream call.
+
+Calls that miss the cache go through ``protected_get``: every call has a
+total deadline, failed calls are retried with exponential backoff while the
+shared retry budget allows, and a circuit breaker shared by all workers
+fails fast while the API is unhealthy.
+"""
+
+import os
+import random
+import time
+from typing import Optional
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from .resilience import CircuitBreaker, RetryBudget
+
+API_URL = "https://api.electricitymap.org/v3/"
+DEFAULT_CACHE_TTL = 300
+
+_client = {"pid": None, "session": None}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised instead of calling the API while the circuit breaker is open.
+    """
+
+
+def breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        "electricitymap",
+        threshold=settings.ELECTRICITY_MAP_BREAKER_THRESHOLD,
+        window=settings.ELECTRICITY_MAP_BREAKER_WINDOW,
+        cooldown=settings.ELECTRICITY_MAP_BREAKER_COOLDOWN,
+    )
+
+
+def retry_budget() -> RetryBudget:
+    return RetryBudget(
+        "electricitymap",
+        ratio=settings.ELECTRICITY_MAP_RETRY_BUDGET,
+        minimum=settings.ELECTRICITY_MAP_RETRY_BUDGET_MIN,
+        window=settings.ELECTRICITY_MAP_BREAKER_WINDOW,
+    )
+
+
+def build_session() -> requests.Session:
+    """
+    Create a session with a sized connection pool and the default auth
+    headers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1, pool_maxsize=settings.ELECTRICITY_MAP_POOL_SIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(
+        {"Authorization": f"Bearer {settings.ELECTRICITY_MAP_API_KEY}"}
+    )
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Return the session of the current process, creating it on first use.
+    """
+    if _client["pid"] != os.getpid():
+        _client.update(pid=os.getpid(), session=build_session())
+    return _client["session"]
+
+
+def get(
+    path: str, params: Optional[dict] = None, timeout: Optional[tuple] = None
+) -> requests.Response:
+    """
+    Send a GET request to an ElectricityMap API endpoint.
+
+    Args:
+        path (str): Endpoint path relative to the API root,
+            e.g. ``"carbon-intensity/latest"``.
+        params (dict, optional): Query string parameters.
+        timeout (tuple, optional): ``(connect, read)`` timeouts in seconds.
+            Defaults to the configured ones.
+
+    Returns:
+        requests.Response: The response.
+    """
+    timeout = timeout or (
+        settings.ELECTRICITY_MAP_CONNECT_TIMEOUT,
+        settings.ELECTRICITY_MAP_READ_TIMEOUT,
+    )
+    return get_session().get(API_URL + path, params=params, timeout=timeout)
+
+
+def is_failure(response: requests.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def protected_get(path: str, params: Optional[dict] = None) -> requests.Response:
+    """
+    GET an API endpoint within ``ELECTRICITY_MAP_CALL_DEADLINE`` seconds,
+    retrying timeouts, connection errors, 429 and 5xx responses with
+    exponential backoff.
+
+    Raises:
+        CircuitOpenError: The circuit breaker is open.
+        requests.RequestException: The last attempt failed without a
+            response.
+
+    Returns:
+        requests.Response: The last response.
+    """
+    circuit = breaker()
+    budget = retry_budget()
+    if not circuit.allow():
+        raise CircuitOpenError(f"Circuit {circuit.name} is open.")
+
+    budget.record_call()
+    deadline = time.monotonic() + settings.ELECTRICITY_MAP_CALL_DEADLINE
+    attempt = 0
+    while True:
+        timeout = (
+            settings.ELECTRICITY_MAP_CONNECT_TIMEOUT,
+            min(settings.ELECTRICITY_MAP_READ_TIMEOUT, deadline - time.monotonic()),
+        )
+        try:
+            response = get(path, params, timeout)
+            error = None
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            response, error = None, exc
+
+        if response is not None and not is_failure(response):
+            circuit.record_success()
+            return response
+
+        circuit.record_failure()
+        attempt += 1
+        delay = settings.ELECTRICITY_MAP_RETRY_BACKOFF * 2 ** (attempt - 1)
+        delay *= random.uniform(0.5, 1)
+        if (
+            attempt > settings.ELECTRICITY_MAP_MAX_RETRIES
+            or time.monotonic() + delay >= deadline
+            or not circuit.allow()
+            or not budget.take()
+        ):
+            if error is not None:
+                raise error
+            return response
+        time.sleep(delay)
+
+
+def upstream_metrics() -> dict:
+    """
+    Return the circuit breaker state, the number of short-circuited calls
+    and the usage of the current retry budget window.
+    """
+    return {**breaker().metrics(), "retry_budget": retry_budget().metrics()}
+
+
+def cache_key(path: str, params: Optional[dict] = None) -> str:
+    return f"electricitymap:{path}?{urlencode(sorted((params or {}).items()))}"
+
+
+def get_json(path: str, params: Optional[dict] = None) -> tuple[int, dict]:
+    """
+    Read-through cached GET of an ElectricityMap API endpoint. Only
+    successful responses are cached.
+
+    Returns:
+        tuple[int, dict]: The HTTP status code and the decoded payload.
+    """
+    key = cache_key(path, params)
+    data = cache.get(key)
+    if data is not None:
+        return 200, data
+
+    response = protected_get(path, params)
+    try:
+        data = response.json()
+    except ValueError:
+        data = {}
+
+    if response.status_code == 200:
+        ttl = settings.ELECTRICITY_MAP_CACHE_TTL.get(path, DEFAULT_CACHE_TTL)
+        cache.set(key, data, ttl)
+    return response.status_code, data
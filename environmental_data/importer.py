@@ -0,0 +1,503 @@
+import hashlib
+import resource
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+
+import django
+import pandas as pd
+from django.db import connections, transaction
+
+from . import dimensions
+from .bulk_load import apply_fast_pragmas, fast_sqlite_mode, restore_dropped_indexes
+from .coverage import refresh_coverage
+from .pipeline import SHEET_NAME, read_workbook_chunks
+from .response_cache import bump_generation, bump_records_version
+from .rollup import refresh_totals
+from .snapshot import export_snapshot
+from .models import (
+    HistoricalEnvironmentalRecord,
+    ImportedFile,
+    Substance,
+)
+
+ID_COLUMNS = ["country_code", "country_name", "sector"]
+NATURAL_KEY = ["country_id", "sector_id", "year"]
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_SUBSTANCE = "CO2"
+FAST_CHUNKS_PER_TRANSACTION = 20
+DATASET_SUFFIXES = {".csv", ".xlsx"}
+
+
+@dataclass
+class ImportStats:
+    """
+    Counters collected while importing a dataset.
+    """
+
+    path: str = ""
+    substance: str = ""
+    rows: int = 0
+    created: int = 0
+    updated: int = 0
+    skipped: bool = False
+    started: float = field(default_factory=time.perf_counter)
+    finished: float = 0.0
+    peak_memory_mb: float = 0.0
+
+    def finish(self) -> None:
+        self.finished = time.perf_counter()
+        # ru_maxrss is reported in kilobytes on Linux.
+        self.peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def unchanged(self) -> int:
+        return self.rows - self.created - self.updated
+
+
+def file_fingerprint(file_path, block_size: int = 1 << 20) -> str:
+    """
+    Return the SHA-256 hex digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while block := file.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def collect_files(paths: Iterable) -> list[Path]:
+    """
+    Expand ``paths`` into a sorted list of dataset files. Directories
+    contribute every dataset file they contain.
+    """
+    files = set()
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.update(
+                child for child in path.iterdir() if child.suffix in DATASET_SUFFIXES
+            )
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def substance_for_file(file_path, default: str = DEFAULT_SUBSTANCE) -> str:
+    """
+    Infer the substance from an EDGAR file name such as
+    ``IEA_EDGAR_CH4_1970_2023.csv``, falling back to ``default``.
+    """
+    aliases = Substance.load_aliases()
+    for token in Path(file_path).stem.split("_"):
+        name = Substance.normalize_substance_name(token, aliases)
+        if name in aliases:
+            return name
+    return default
+
+
+def read_chunks(
+    file_path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    columns: list | None = None,
+    sheet_name: str = SHEET_NAME,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream a dataset in chunks of ``chunk_size`` rows, optionally reading
+    only ``columns``. Raw EDGAR workbooks are cleaned on the fly; anything
+    else is read as a cleaned CSV.
+    """
+    if Path(file_path).suffix == ".xlsx":
+        return read_workbook_chunks(file_path, chunk_size, columns, sheet_name)
+
+    # Only empty cells are missing values; "NA" is Namibia's country code.
+    return pd.read_csv(
+        file_path,
+        chunksize=chunk_size,
+        usecols=columns,
+        keep_default_na=False,
+        na_values=[""],
+    )
+
+
+def melt_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn a wide EDGAR chunk (one column per year) into long format with
+    one row per (country, sector, year) and drop empty cells.
+    """
+    year_columns = [column for column in chunk.columns if str(column).isdigit()]
+    chunk = chunk.dropna(subset=["country_code", "sector"])
+
+    long = chunk.melt(
+        id_vars=ID_COLUMNS,
+        value_vars=year_columns,
+        var_name="year",
+        value_name="value",
+    ).dropna(subset=["value"])
+    long["year"] = long["year"].astype(int)
+    return long
+
+
+def sum_duplicates(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Collapse rows that share a natural key into one row with the summed
+    value. EDGAR reports fossil and bio emissions of a sector as separate
+    rows, which the cleaned data no longer tells apart.
+    """
+    return (
+        frame.astype({"country_id": int, "sector_id": int})
+        .groupby(NATURAL_KEY, as_index=False, sort=False)["value"]
+        .sum()
+    )
+
+
+class DimensionMap:
+    """
+    Maps from country codes and sector names to primary keys for one import.
+
+    Keys are resolved through the shared dimension caches once per import
+    and missing dimensions are created in bulk, so the import never does a
+    per-row ``get_or_create``.
+    """
+
+    def __init__(self):
+        self.countries = {}
+        self.sectors = {}
+
+    def resolve(self, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add ``country_id`` and ``sector_id`` columns to ``frame``.
+        """
+        countries = frame.drop_duplicates("country_code")
+        missing = countries[~countries["country_code"].isin(self.countries.keys())]
+        if not missing.empty:
+            self.countries.update(
+                dimensions.countries.get_many(
+                    missing["country_code"],
+                    defaults={
+                        code: {"name": name}
+                        for code, name in zip(
+                            missing["country_code"], missing["country_name"]
+                        )
+                    },
+                )
+            )
+
+        sectors = frame["sector"].unique()
+        missing = [name for name in sectors if name not in self.sectors]
+        if missing:
+            self.sectors.update(dimensions.sectors.get_many(missing))
+
+        frame = frame.assign(
+            country_id=frame["country_code"].map(self.countries),
+            sector_id=frame["sector"].map(self.sectors),
+        )
+        return frame.dropna(subset=["country_id", "sector_id"])
+
+
+def build_records(
+    frame: pd.DataFrame, substance_id: int
+) -> Iterator[HistoricalEnvironmentalRecord]:
+    for country_id, sector_id, year, value in zip(
+        frame["country_id"].astype(int),
+        frame["sector_id"].astype(int),
+        frame["year"],
+        frame["value"],
+    ):
+        yield HistoricalEnvironmentalRecord(
+            country_id=country_id,
+            sector_id=sector_id,
+            substance_id=substance_id,
+            year=int(year),
+            value=float(value),
+        )
+
+
+def changed_rows(frame: pd.DataFrame, substance_id: int) -> pd.DataFrame:
+    """
+    Compare ``frame`` with the stored values for the same natural keys and
+    return only the rows that are new or whose value changed. The returned
+    frame has an ``exists`` column telling updates apart from inserts.
+
+    Rows flagged in an optional ``repeat`` column are further parts of a
+    value the running import already stored, so they are added to the
+    stored value instead of replacing it.
+    """
+    existing = pd.DataFrame.from_records(
+        HistoricalEnvironmentalRecord.objects.filter(
+            substance_id=substance_id,
+            country_id__in=frame["country_id"].unique().tolist(),
+            sector_id__in=frame["sector_id"].unique().tolist(),
+            year__in=frame["year"].unique().tolist(),
+        )
+        .order_by()
+        .values_list(*NATURAL_KEY, "value"),
+        columns=NATURAL_KEY + ["stored_value"],
+    )
+    frame = frame.astype({"country_id": int, "sector_id": int})
+    merged = frame.merge(
+        existing.astype({key: int for key in NATURAL_KEY}),
+        on=NATURAL_KEY,
+        how="left",
+    )
+    merged["exists"] = merged["stored_value"].notna()
+    if "repeat" in merged and merged["repeat"].any():
+        repeat = merged["repeat"] & merged["exists"]
+        merged.loc[repeat, "value"] += merged.loc[repeat, "stored_value"]
+    return merged[~merged["exists"] | (merged["value"] != merged["stored_value"])]
+
+
+def insert_batches(
+    records: Iterable[HistoricalEnvironmentalRecord],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """
+    Upsert ``records`` on the natural key with at most ``batch_size``
+    objects held in memory.
+    """
+    written = 0
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        HistoricalEnvironmentalRecord.objects.bulk_create(
+            batch,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["country", "sector", "substance", "year"],
+            update_fields=["value"],
+        )
+        written += len(batch)
+    return written
+
+
+def import_file(
+    file_path,
+    substance_name: str = DEFAULT_SUBSTANCE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    sheet_name: str = SHEET_NAME,
+    chunks_per_transaction: int = 1,
+) -> ImportStats:
+    """
+    Stream an EDGAR dataset into ``HistoricalEnvironmentalRecord``.
+
+    Rows are upserted on (country, sector, substance, year) and only rows
+    that are new or whose value changed are written. Rows sharing that key,
+    such as EDGAR's fossil and bio rows of a sector, are summed. By default each chunk
+    is written in its own transaction so concurrent importers only hold the
+    write lock while writing. The country totals and the coverage index of
+    the written countries are refreshed in the same transaction.
+
+    Args:
+        file_path: Path to a cleaned CSV or a raw EDGAR workbook.
+        substance_name (str): Substance the dataset reports on.
+        chunk_size (int): Number of input rows read per chunk.
+        batch_size (int): Maximum number of records per ``bulk_create``.
+        sheet_name (str): Worksheet to read from workbooks.
+        chunks_per_transaction (int): Number of chunks committed together.
+
+    Returns:
+        ImportStats: Row counts, duration and peak memory of the import.
+    """
+    stats = ImportStats(path=str(file_path), substance=substance_name)
+    substance_id = dimensions.substances.get(substance_name)
+    dimension_map = DimensionMap()
+    # Years processed per (country_id, sector_id), to merge duplicate keys
+    # that land in different chunks.
+    seen = defaultdict(set)
+
+    chunks = read_chunks(file_path, chunk_size, sheet_name=sheet_name)
+    while group := list(islice(chunks, chunks_per_transaction)):
+        with transaction.atomic():
+            countries, years = set(), set()
+            for chunk in group:
+                frame = dimension_map.resolve(melt_chunk(chunk))
+                if frame.empty:
+                    continue
+
+                frame = sum_duplicates(frame)
+                keys = list(zip(frame["country_id"], frame["sector_id"], frame["year"]))
+                frame["repeat"] = [
+                    year in seen.get((country_id, sector_id), ())
+                    for country_id, sector_id, year in keys
+                ]
+                stats.rows += len(frame) - int(frame["repeat"].sum())
+
+                changed = changed_rows(frame, substance_id)
+                insert_batches(build_records(changed, substance_id), batch_size)
+                first = changed[~changed["repeat"]]
+                stats.updated += int(first["exists"].sum())
+                stats.created += len(first) - int(first["exists"].sum())
+                for country_id, sector_id, year in keys:
+                    seen[country_id, sector_id].add(year)
+                countries.update(changed["country_id"].astype(int).tolist())
+                years.update(changed["year"].astype(int).tolist())
+            refresh_totals(substance_id, countries, years)
+            refresh_coverage(substance_id, countries)
+
+    stats.finish()
+    return stats
+
+
+def import_dataset(
+    file_path,
+    substance_name: str = DEFAULT_SUBSTANCE,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    sheet_name: str = SHEET_NAME,
+    chunks_per_transaction: int = 1,
+    force: bool = False,
+) -> ImportStats:
+    """
+    Import ``file_path`` unless the manifest shows the same content was
+    already loaded. The manifest entry is only written once every chunk
+    is stored, so a failed import is retried on the next run; the upsert
+    makes re-applying the chunks that did get written harmless.
+    """
+    path = str(file_path)
+    fingerprint = file_fingerprint(file_path)
+
+    if (
+        not force
+        and ImportedFile.objects.filter(path=path, sha256=fingerprint).exists()
+    ):
+        stats = ImportStats(path=path, substance=substance_name, skipped=True)
+        stats.finish()
+        return stats
+
+    stats = import_file(
+        file_path,
+        substance_name,
+        chunk_size,
+        batch_size,
+        sheet_name,
+        chunks_per_transaction,
+    )
+    ImportedFile.objects.update_or_create(
+        path=path, defaults={"sha256": fingerprint, "rows": stats.rows}
+    )
+    return stats
+
+
+def prepare_dimensions(
+    files_by_substance: dict,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    sheet_name: str = SHEET_NAME,
+) -> None:
+    """
+    Create every country, sector and substance referenced by the given
+    files before any records are imported, so parallel workers only ever
+    read the dimension tables.
+    """
+    dimensions.substances.get_many(files_by_substance)
+    dimension_map = DimensionMap()
+    for files in files_by_substance.values():
+        for file_path in files:
+            for chunk in read_chunks(file_path, chunk_size, ID_COLUMNS, sheet_name):
+                frame = chunk.dropna(subset=["country_code", "sector"])
+                dimension_map.resolve(frame.drop_duplicates())
+
+
+def _init_worker() -> None:
+    # Spawned workers need their own app registry; forked ones must not
+    # share the parent's database connection.
+    django.setup()
+    connections.close_all()
+
+
+def _import_group(
+    substance_name: str, files: list, options: dict, fast: bool = False
+) -> list:
+    if fast:
+        apply_fast_pragmas()
+    return [import_dataset(file_path, substance_name, **options) for file_path in files]
+
+
+def import_many(
+    paths: Iterable,
+    substance_name: str | None = None,
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    sheet_name: str = SHEET_NAME,
+    force: bool = False,
+    fast: bool = False,
+) -> list[ImportStats]:
+    """
+    Import every dataset file found in ``paths`` across a process pool.
+
+    Files are grouped by substance and each group is imported in order by
+    a single worker, so vintages of the same dataset are applied oldest
+    to newest and workers never write the same natural keys. The
+    analytics snapshot is regenerated whenever any record changed.
+
+    Args:
+        paths: Files or directories to import.
+        substance_name (str | None): Substance for every file. Inferred
+            from each file name when omitted.
+        workers (int): Number of worker processes. ``1`` imports in-process.
+        chunk_size (int): Number of input rows read per chunk.
+        batch_size (int): Maximum number of records per ``bulk_create``.
+        sheet_name (str): Worksheet to read from workbooks.
+        force (bool): Import files even if the manifest shows them unchanged.
+        fast (bool): Load in SQLite bulk-load mode with large transactions.
+
+    Returns:
+        list[ImportStats]: One entry per imported file.
+    """
+    files_by_substance = defaultdict(list)
+    for file_path in collect_files(paths):
+        name = substance_name or substance_for_file(file_path)
+        files_by_substance[name].append(file_path)
+
+    # Rebuild indexes left dropped by an interrupted fast import.
+    restore_dropped_indexes()
+    prepare_dimensions(files_by_substance, chunk_size, sheet_name)
+    options = {
+        "chunk_size": chunk_size,
+        "batch_size": batch_size,
+        "sheet_name": sheet_name,
+        "chunks_per_transaction": FAST_CHUNKS_PER_TRANSACTION if fast else 1,
+        "force": force,
+    }
+    workers = min(workers, len(files_by_substance))
+    bulk_load = (
+        fast_sqlite_mode([HistoricalEnvironmentalRecord._meta.db_table])
+        if fast
+        else nullcontext()
+    )
+
+    with bulk_load:
+        if workers <= 1:
+            groups = [
+                _import_group(name, files, options)
+                for name, files in files_by_substance.items()
+            ]
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=_init_worker) as pool:
+                futures = [
+                    pool.submit(_import_group, name, files, options, fast)
+                    for name, files in files_by_substance.items()
+                ]
+                groups = [future.result() for future in futures]
+
+    results = [stats for group in groups for stats in group]
+    if any(stats.created or stats.updated for stats in results):
+        # Bump first so the snapshot is stamped with the new version.
+        bump_generation()
+        bump_records_version()
+        export_snapshot()
+    return results
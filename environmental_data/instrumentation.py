@@ -0,0 +1,141 @@
+"""
+SQL query counting for views and Celery tasks.
+
+``track_queries`` counts the queries run on the default connection and the
+time spent in them. ``QueryStatsMiddleware`` wraps every request in it and
+logs the numbers; with ``QUERY_STATS_HEADER`` enabled they are also sent in
+the ``X-Query-Count`` and ``Server-Timing`` response headers. Celery tasks
+are tracked through the task signals.
+
+Views declare the most queries a request may take in ``query_budget``. A
+request over budget is logged as a warning, and
+``environmental_data.testing.QueryBudgetMixin`` fails tests on it.
+"""
+
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    Database execute wrapper that counts queries and their duration.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+    @property
+    def milliseconds(self) -> float:
+        return round(self.seconds * 1000, 3)
+
+
+@contextmanager
+def track_queries(label: str):
+    """
+    Count the queries run inside the block and log them under ``label``.
+    """
+    stats = QueryStats()
+    with connection.execute_wrapper(stats):
+        yield stats
+    logger.info("%s: %d queries in %.1f ms", label, stats.count, stats.milliseconds)
+
+
+def check_budget(label: str, stats: QueryStats, budget) -> None:
+    if budget is not None and stats.count > budget:
+        logger.warning(
+            "%s ran %d queries, over its budget of %d", label, stats.count, budget
+        )
+
+
+def view_budget(view_func):
+    """
+    Return the ``query_budget`` declared by a view function or class.
+    """
+    view_class = getattr(view_func, "view_class", None) or getattr(
+        view_func, "cls", None
+    )
+    return getattr(view_class or view_func, "query_budget", None)
+
+
+class QueryStatsMiddleware:
+    """
+    Count the queries of every request. The queries of a streaming response
+    run while it is sent, so they are logged once the stream ends and are
+    not part of its headers.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        label = f"{request.method} {request.path}"
+        with track_queries(label) as stats:
+            response = self.get_response(request)
+            budget = getattr(request, "query_budget", None)
+
+        if response.streaming:
+            response.streaming_content = self.tracked_stream(
+                response.streaming_content, label, stats, budget
+            )
+            return response
+
+        check_budget(label, stats, budget)
+        if settings.QUERY_STATS_HEADER:
+            response["X-Query-Count"] = str(stats.count)
+            response["Server-Timing"] = (
+                f'db;dur={stats.milliseconds};desc="{stats.count} queries"'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = view_budget(view_func)
+
+    @staticmethod
+    def tracked_stream(content, label, stats, budget):
+        content = iter(content)
+        while True:
+            with connection.execute_wrapper(stats):
+                chunk = next(content, None)
+            if chunk is None:
+                break
+            yield chunk
+        logger.info(
+            "%s (streamed): %d queries in %.1f ms",
+            label,
+            stats.count,
+            stats.milliseconds,
+        )
+        check_budget(label, stats, budget)
+
+
+_task_stats = {}
+
+
+@task_prerun.connect
+def start_task_tracking(task_id=None, task=None, **kwargs):
+    stack = ExitStack()
+    stats = stack.enter_context(track_queries(f"task {task.name}"))
+    _task_stats[task_id] = (stack, stats)
+
+
+@task_postrun.connect
+def stop_task_tracking(task_id=None, **kwargs):
+    stack, _ = _task_stats.pop(task_id, (None, None))
+    if stack is not None:
+        stack.close()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from environmental_data.tasks import start_backfill
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill historical carbon intensity for the given zones. Windows "
+        "completed by an earlier run are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("zones", nargs="+", help="Zone codes, e.g. DE FR.")
+        parser.add_argument("--start", required=True, help="ISO start datetime (UTC).")
+        parser.add_argument("--end", required=True, help="ISO end datetime (UTC).")
+        parser.add_argument(
+            "--window-hours",
+            type=int,
+            help="Hours per upstream request. Defaults to BACKFILL_WINDOW_HOURS.",
+        )
+
+    def handle(self, *args, **kwargs):
+        queued = start_backfill(
+            kwargs["zones"], kwargs["start"], kwargs["end"], kwargs["window_hours"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Queued {queued} backfill windows."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from environmental_data.snapshot import export_snapshot
+
+
+class Command(BaseCommand):
+    help = "Export historical records to a memory-mapped columnar snapshot."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--directory",
+            help="Snapshot directory. Defaults to HISTORICAL_SNAPSHOT_DIR.",
+        )
+
+    def handle(self, *args, **kwargs):
+        path = export_snapshot(kwargs["directory"])
+        self.stdout.write(self.style.SUCCESS(f"Snapshot written to {path}."))
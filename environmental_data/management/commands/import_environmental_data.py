@@ -1,46 +1,86 @@
 import os
 from django.core.management.base import BaseCommand
-import pandas as pd
-from environmental_data.models import (
-    HistoricalEnvironmentalRecord,
-    Country,
-    Sector,
-    Substance,
+from environmental_data.pipeline import SHEET_NAME
+from environmental_data.importer import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    import_many,
 )
 
 
 class Command(BaseCommand):
-    help = "Import emissions data from a CSV file."
+    help = "Import emissions data from EDGAR workbooks or cleaned CSV files."
 
-    def handle(self, *args, **kwargs):
-        file_path = os.getcwd() + "/data/datasets/IEA_EDGAR_CO2_1970_2023_cleaned.csv"
-        df = pd.read_csv(file_path)
-        records_to_create = []
-
-        for _, row in df.iterrows():
-            country, _ = Country.objects.get_or_create(
-                code=row["country_code"], defaults={"name": row["country_name"]}
-            )
-
-            substance, _ = Substance.objects.get_or_create(name="CO2")
-            sector, _ = Sector.objects.get_or_create(name=row["sector"])
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            default=[os.getcwd() + "/data/datasets/IEA_EDGAR_CO2_1970_2023.xlsx"],
+            help="Dataset files or directories containing them.",
+        )
+        parser.add_argument(
+            "--substance",
+            help="Substance for every file. Inferred from the file names if omitted.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of worker processes.",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Number of input rows read per chunk.",
+        )
+        parser.add_argument(
+            "--sheet",
+            default=SHEET_NAME,
+            help="Worksheet to read from EDGAR workbooks.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Maximum number of records per bulk insert.",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Import files even if the manifest shows them unchanged.",
+        )
+        parser.add_argument(
+            "--fast",
+            action="store_true",
+            help=(
+                "SQLite bulk-load mode: WAL journal, relaxed synchronous writes, "
+                "secondary indexes rebuilt after the load."
+            ),
+        )
 
-            for year in range(1970, 2023):
-                column_name = str(year)
-                emission_value = row[column_name]
-
-                if not pd.isna(emission_value):
-                    records_to_create.append(
-                        HistoricalEnvironmentalRecord(
-                            country=country,
-                            substance=substance,
-                            sector=sector,
-                            value=emission_value,
-                            year=year,
-                        )
-                    )
+    def handle(self, *args, **kwargs):
+        results = import_many(
+            kwargs["paths"],
+            substance_name=kwargs["substance"],
+            workers=kwargs["workers"],
+            chunk_size=kwargs["chunk_size"],
+            batch_size=kwargs["batch_size"],
+            sheet_name=kwargs["sheet"],
+            force=kwargs["force"],
+            fast=kwargs["fast"],
+        )
 
-        if records_to_create:
-            HistoricalEnvironmentalRecord.objects.bulk_create(records_to_create)
+        for stats in results:
+            if stats.skipped:
+                self.stdout.write(f"{stats.path} is unchanged, skipping.")
+                continue
 
+            self.stdout.write(
+                f"{stats.path} ({stats.substance}): processed {stats.rows} records "
+                f"({stats.created} created, {stats.updated} updated, "
+                f"{stats.unchanged} unchanged) in {stats.seconds:.2f}s "
+                f"({stats.rows_per_second:.0f} rows/s, "
+                f"peak memory {stats.peak_memory_mb:.1f} MB)."
+            )
         self.stdout.write(self.style.SUCCESS("Emissions data imported successfully."))
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:17
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """
+    Earlier imports appended the whole dataset on every run, and stored
+    EDGAR's fossil and bio rows of a sector as separate records. Before the
+    constraint is added, the rows of each natural key are merged into the
+    most recently inserted one. Their distinct values are summed so that
+    repeated runs are not counted twice.
+    """
+    HistoricalEnvironmentalRecord = apps.get_model(
+        "environmental_data", "HistoricalEnvironmentalRecord"
+    )
+    keys = HistoricalEnvironmentalRecord.objects.values(
+        "country", "sector", "substance", "year"
+    ).annotate(keep_id=Max("id"))
+    duplicates = keys.annotate(
+        rows=Count("id"), total=Sum("value", distinct=True)
+    ).filter(rows__gt=1)
+    for duplicate in duplicates.iterator():
+        HistoricalEnvironmentalRecord.objects.filter(id=duplicate["keep_id"]).update(
+            value=duplicate["total"]
+        )
+    HistoricalEnvironmentalRecord.objects.exclude(
+        id__in=keys.values("keep_id")
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0002_rename_region_country_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportedFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=500, unique=True)),
+                ("sha256", models.CharField(max_length=64)),
+                ("rows", models.IntegerField(default=0)),
+                ("imported_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="historicalenvironmentalrecord",
+            unique_together={("country", "sector", "substance", "year")},
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0003_importedfile_historical_natural_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DroppedIndex",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=200, unique=True)),
+                ("table", models.CharField(max_length=200)),
+                ("sql", models.TextField()),
+            ],
+        ),
+    ]
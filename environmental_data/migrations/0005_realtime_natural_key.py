@@ -0,0 +1,35 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:28
+
+from django.db import migrations
+from django.db.models import Max
+
+
+def remove_duplicate_records(apps, schema_editor):
+    """
+    Keep the most recently inserted reading for each (country, substance,
+    timestamp) so the constraint can be added.
+    """
+    RealtimeEnvironmentalRecord = apps.get_model(
+        "environmental_data", "RealtimeEnvironmentalRecord"
+    )
+    keep_ids = (
+        RealtimeEnvironmentalRecord.objects.values("country", "substance", "timestamp")
+        .annotate(keep_id=Max("id"))
+        .values("keep_id")
+    )
+    RealtimeEnvironmentalRecord.objects.exclude(id__in=keep_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0004_droppedindex"),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_records, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="realtimeenvironmentalrecord",
+            unique_together={("country", "substance", "timestamp")},
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0006_backfillwindow_tokenbucket"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ZonePollState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("zone", models.CharField(max_length=50, unique=True)),
+                (
+                    "interval",
+                    models.FloatField(
+                        help_text="Learned seconds between upstream updates"
+                    ),
+                ),
+                ("last_reading_at", models.DateTimeField(blank=True, null=True)),
+                ("last_updated_at", models.DateTimeField(blank=True, null=True)),
+                ("quiet_polls", models.IntegerField(default=0)),
+                ("next_poll_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
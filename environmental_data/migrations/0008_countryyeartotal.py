@@ -0,0 +1,74 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def build_country_totals(apps, schema_editor):
+    """
+    Fill the rollup from the records that are already imported.
+    """
+    HistoricalEnvironmentalRecord = apps.get_model(
+        "environmental_data", "HistoricalEnvironmentalRecord"
+    )
+    CountryYearTotal = apps.get_model("environmental_data", "CountryYearTotal")
+    totals = (
+        HistoricalEnvironmentalRecord.objects.order_by()
+        .values_list("country_id", "substance_id", "year")
+        .annotate(total=Sum("value"))
+    )
+    CountryYearTotal.objects.bulk_create(
+        [
+            CountryYearTotal(
+                country_id=country_id, substance_id=substance_id, year=year, total=total
+            )
+            for country_id, substance_id, year, total in totals.iterator()
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0007_zonepollstate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CountryYearTotal",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("year", models.IntegerField()),
+                ("total", models.FloatField()),
+                (
+                    "country",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="environmental_data.country",
+                    ),
+                ),
+                (
+                    "substance",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="environmental_data.substance",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-year"],
+                "unique_together": {("country", "substance", "year")},
+            },
+        ),
+        migrations.RunPython(build_country_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0008_countryyeartotal"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="historicalenvironmentalrecord",
+            index=models.Index(
+                fields=["-year", "country", "sector", "substance"],
+                name="historical_keyset_idx",
+            ),
+        ),
+    ]
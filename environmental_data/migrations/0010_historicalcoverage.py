@@ -0,0 +1,93 @@
+# Generated by Django 5.1.3 on 2026-10-17 22:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+
+
+def build_coverage(apps, schema_editor):
+    """
+    Fill the coverage index from the records that are already imported.
+    """
+    HistoricalEnvironmentalRecord = apps.get_model(
+        "environmental_data", "HistoricalEnvironmentalRecord"
+    )
+    HistoricalCoverage = apps.get_model("environmental_data", "HistoricalCoverage")
+    coverage = (
+        HistoricalEnvironmentalRecord.objects.order_by()
+        .values_list("country_id", "sector_id", "substance_id")
+        .annotate(first_year=Min("year"), last_year=Max("year"), rows=Count("id"))
+    )
+    HistoricalCoverage.objects.bulk_create(
+        [
+            HistoricalCoverage(
+                country_id=country_id,
+                sector_id=sector_id,
+                substance_id=substance_id,
+                first_year=first_year,
+                last_year=last_year,
+                rows=rows,
+            )
+            for (
+                country_id,
+                sector_id,
+                substance_id,
+                first_year,
+                last_year,
+                rows,
+            ) in coverage.iterator()
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("environmental_data", "0009_historical_keyset_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HistoricalCoverage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("first_year", models.IntegerField()),
+                ("last_year", models.IntegerField()),
+                ("rows", models.IntegerField()),
+                (
+                    "country",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="environmental_data.country",
+                    ),
+                ),
+                (
+                    "sector",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="environmental_data.sector",
+                    ),
+                ),
+                (
+                    "substance",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="environmental_data.substance",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("country", "sector", "substance")},
+            },
+        ),
+        migrations.RunPython(build_coverage, migrations.RunPython.noop),
+    ]
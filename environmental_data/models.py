@@ -74,7 +74,6 @@ class EnvironmentalRecord(models.Model):
 
     class Meta:
         abstract = True
-        unique_together = ("country", "substance", "timestamp")
 
 
 class RealtimeEnvironmentalRecord(EnvironmentalRecord):
@@ -87,6 +86,7 @@ class RealtimeEnvironmentalRecord(EnvironmentalRecord):
 
     class Meta:
         ordering = ["-timestamp"]
+        unique_together = ("country", "substance", "timestamp")
 
     def __str__(self):
         return f"{self.country} - {self.substance} - {self.timestamp}"
@@ -103,6 +103,143 @@ class HistoricalEnvironmentalRecord(EnvironmentalRecord):
 
     class Meta:
         ordering = ["-year"]
+        unique_together = ("country", "sector", "substance", "year")
+        indexes = [
+            # Keyset pagination order of the historical data API.
+            models.Index(
+                fields=["-year", "country", "sector", "substance"],
+                name="historical_keyset_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.country} - {self.substance} - {self.year}"
+
+
+class CountryYearTotal(models.Model):
+    """
+    Sum of ``HistoricalEnvironmentalRecord.value`` over all sectors per
+    country, substance and year, kept up to date by the importer.
+    """
+
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    substance = models.ForeignKey(Substance, on_delete=models.CASCADE)
+    year = models.IntegerField()
+    total = models.FloatField()
+
+    class Meta:
+        ordering = ["-year"]
+        unique_together = ("country", "substance", "year")
+
+    def __str__(self):
+        return f"{self.country} - {self.substance} - {self.year}: {self.total}"
+
+
+class HistoricalCoverage(models.Model):
+    """
+    First and last year and number of ``HistoricalEnvironmentalRecord`` rows
+    per country, sector and substance, kept up to date by the importer.
+    """
+
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    sector = models.ForeignKey(Sector, on_delete=models.CASCADE)
+    substance = models.ForeignKey(Substance, on_delete=models.CASCADE)
+    first_year = models.IntegerField()
+    last_year = models.IntegerField()
+    rows = models.IntegerField()
+
+    class Meta:
+        unique_together = ("country", "sector", "substance")
+
+    def __str__(self):
+        return (
+            f"{self.country} - {self.sector} - {self.substance}: "
+            f"{self.first_year}-{self.last_year}"
+        )
+
+
+class ImportedFile(models.Model):
+    """
+    Manifest entry for a dataset file loaded by ``import_environmental_data``.
+    The content hash lets unchanged files be skipped on the next run.
+    """
+
+    path = models.CharField(max_length=500, unique=True)
+    sha256 = models.CharField(max_length=64)
+    rows = models.IntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.sha256[:12]})"
+
+
+class DroppedIndex(models.Model):
+    """
+    An index dropped by the SQLite bulk-load mode, kept until the index is
+    rebuilt so an interrupted import can be recovered.
+    """
+
+    name = models.CharField(max_length=200, unique=True)
+    table = models.CharField(max_length=200)
+    sql = models.TextField()
+
+    def __str__(self):
+        return self.name
+
+
+class BackfillWindow(models.Model):
+    """
+    One upstream-sized slice of a carbon intensity backfill. Completed
+    windows are checkpointed so a restarted backfill skips them.
+    """
+
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (DONE, "Done"), (FAILED, "Failed")]
+
+    zone = models.CharField(max_length=50)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    inserted = models.IntegerField(default=0)
+    error = models.CharField(max_length=200, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["zone", "start"]
+        unique_together = ("zone", "start", "end")
+
+    def __str__(self):
+        return f"{self.zone} {self.start:%Y-%m-%d %H:%M} - {self.end:%Y-%m-%d %H:%M}"
+
+
+class TokenBucket(models.Model):
+    """
+    State of a token-bucket rate limit shared by all workers.
+    """
+
+    name = models.CharField(max_length=100, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name}: {self.tokens:.2f}"
+
+
+class ZonePollState(models.Model):
+    """
+    Polling schedule of one realtime zone, learned from how often its
+    readings change upstream.
+    """
+
+    zone = models.CharField(max_length=50, unique=True)
+    interval = models.FloatField(help_text="Learned seconds between upstream updates")
+    last_reading_at = models.DateTimeField(null=True, blank=True)
+    last_updated_at = models.DateTimeField(null=True, blank=True)
+    quiet_polls = models.IntegerField(default=0)
+    next_poll_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.zone} every {self.interval:.0f}s, next {self.next_poll_at}"
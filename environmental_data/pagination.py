@@ -0,0 +1,87 @@
+"""
+Keyset pagination for the historical data API.
+
+Pages are ordered by ``(-year, country, sector, substance)``, the order of
+``historical_keyset_idx``. A cursor encodes the key of the last row of a
+page and the next page starts right after it, so every page is one index
+range scan no matter how deep it is.
+"""
+
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+KEYSET_ORDER = ["-year", "country_id", "sector_id", "substance_id"]
+KEY_FIELDS = ["year", "country_id", "sector_id", "substance_id"]
+
+
+def encode_cursor(key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list[int]:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    if not (
+        isinstance(key, list)
+        and len(key) == len(KEY_FIELDS)
+        and all(isinstance(value, int) for value in key)
+    ):
+        raise ValidationError({"cursor": "Invalid cursor."})
+    return key
+
+
+def page_size(value) -> int:
+    """
+    Parse the requested page size, capped at ``HISTORICAL_PAGE_SIZE_MAX``.
+    """
+    if value in (None, ""):
+        return settings.HISTORICAL_PAGE_SIZE
+    try:
+        size = int(value)
+    except ValueError:
+        raise ValidationError({"page_size": "Must be a positive integer."})
+    if size < 1:
+        raise ValidationError({"page_size": "Must be a positive integer."})
+    return min(size, settings.HISTORICAL_PAGE_SIZE_MAX)
+
+
+def after(key) -> Q:
+    """
+    Match the rows that come after ``key`` in keyset order. The redundant
+    ``year__lte`` bound lets SQLite start the index scan at the cursor.
+    """
+    year, country_id, sector_id, substance_id = key
+    return Q(year__lte=year) & (
+        Q(year__lt=year)
+        | Q(year=year, country_id__gt=country_id)
+        | Q(year=year, country_id=country_id, sector_id__gt=sector_id)
+        | Q(
+            year=year,
+            country_id=country_id,
+            sector_id=sector_id,
+            substance_id__gt=substance_id,
+        )
+    )
+
+
+def keyset_page(queryset, fields: list[str], size: int, cursor=None):
+    """
+    Return one page of ``queryset`` and the cursor of the next page, or
+    ``None`` on the last page. Rows are ``values_list`` tuples of the key
+    fields followed by ``fields``.
+    """
+    if cursor:
+        queryset = queryset.filter(after(decode_cursor(cursor)))
+    rows = list(
+        queryset.order_by(*KEYSET_ORDER).values_list(*KEY_FIELDS, *fields)[: size + 1]
+    )
+    if len(rows) <= size:
+        return rows, None
+    return rows[:size], encode_cursor(rows[size - 1][: len(KEY_FIELDS)])
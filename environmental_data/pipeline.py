@@ -0,0 +1,103 @@
+"""
+Cleaning pipeline for the raw EDGAR workbooks.
+
+This replaces ``data/jupyter/cleaning_edgar.ipynb``: the workbook is read in
+openpyxl's streaming read-only mode and yielded as small frames in the same
+shape as the cleaned CSV, so the importer never stages the whole sheet or
+writes an intermediate file.
+"""
+
+from functools import lru_cache
+from typing import Iterator
+
+import openpyxl
+import pandas as pd
+import pycountry
+
+SHEET_NAME = "IPCC 2006"
+HEADER_MARKER = "Country_code_A3"
+COLUMN_NAMES = {
+    "Country_code_A3": "country_code",
+    "Name": "country_name",
+    "ipcc_code_2006_for_standard_report_name": "sector",
+}
+YEAR_PREFIX = "Y_"
+
+
+@lru_cache(maxsize=None)
+def alpha3_to_alpha2(alpha3_code: str) -> str | None:
+    """
+    Convert an ISO 3166 alpha-3 code to alpha-2. EDGAR aggregates such as
+    international aviation have no ISO code and map to ``None``.
+    """
+    try:
+        country = pycountry.countries.get(alpha_3=alpha3_code)
+        return country.alpha_2 if country else None
+    except (AttributeError, LookupError):
+        return None
+
+
+def iter_sheet_rows(file_path, sheet_name: str = SHEET_NAME) -> Iterator[tuple]:
+    """
+    Yield the cell values of ``sheet_name`` one row at a time.
+    """
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        yield from workbook[sheet_name].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def column_layout(header: tuple) -> dict:
+    """
+    Map cleaned column names (``country_code``, ``sector``, ``"1970"``, ...)
+    to their positions in the EDGAR header row.
+    """
+    layout = {}
+    for index, name in enumerate(header):
+        if name in COLUMN_NAMES:
+            layout[COLUMN_NAMES[name]] = index
+        elif isinstance(name, str) and name.startswith(YEAR_PREFIX):
+            layout[name.removeprefix(YEAR_PREFIX)] = index
+    return layout
+
+
+def read_workbook_chunks(
+    file_path,
+    chunk_size: int,
+    columns: list | None = None,
+    sheet_name: str = SHEET_NAME,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream an EDGAR workbook as cleaned frames of at most ``chunk_size``
+    rows, optionally keeping only ``columns``.
+
+    The metadata rows above the header are skipped and country codes are
+    converted from alpha-3 to alpha-2, as the notebook did.
+    """
+    rows = iter_sheet_rows(file_path, sheet_name)
+    for header in rows:
+        if HEADER_MARKER in header:
+            break
+    else:
+        raise ValueError(f"No EDGAR header row found in sheet {sheet_name!r}.")
+
+    layout = column_layout(header)
+    if columns is not None:
+        layout = {name: layout[name] for name in columns}
+    names = list(layout)
+    positions = list(layout.values())
+    code_position = names.index("country_code")
+
+    chunk = []
+    for row in rows:
+        values = [
+            row[position] if position < len(row) else None for position in positions
+        ]
+        values[code_position] = alpha3_to_alpha2(values[code_position])
+        chunk.append(values)
+        if len(chunk) == chunk_size:
+            yield pd.DataFrame(chunk, columns=names)
+            chunk = []
+    if chunk:
+        yield pd.DataFrame(chunk, columns=names)
@@ -0,0 +1,40 @@
+"""
+Token-bucket rate limiting shared across Celery workers.
+
+The bucket state lives in the database and is updated inside a write
+transaction, so every worker draws from the same budget.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import TokenBucket
+
+
+def take_token(name: str, rate: float, capacity: float) -> float:
+    """
+    Take one token from the bucket ``name``, which refills at ``rate``
+    tokens per second up to ``capacity``.
+
+    Returns:
+        float: ``0`` if a token was taken, otherwise the number of seconds
+        until one will be available.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        bucket, _ = TokenBucket.objects.select_for_update().get_or_create(
+            name=name, defaults={"tokens": capacity, "updated_at": now}
+        )
+        elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+        tokens = min(capacity, bucket.tokens + elapsed * rate)
+
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        bucket.tokens = tokens
+        bucket.updated_at = now
+        bucket.save(update_fields=["tokens", "updated_at"])
+    return wait
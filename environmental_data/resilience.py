@@ -0,0 +1,131 @@
+"""
+Protection for calls to an unhealthy upstream.
+
+``CircuitBreaker`` counts failed calls in the shared cache (Redis), so all
+workers see the same state. After ``threshold`` failures within ``window``
+seconds the breaker opens and every worker fails fast for ``cooldown``
+seconds. After that a single probe call is let through: if it succeeds the
+breaker closes, if it fails the breaker opens again.
+
+``RetryBudget`` caps retries at a share of the calls made in the current
+window, so retries cannot multiply the load on an upstream that is already
+struggling.
+"""
+
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def _increment(key: str, timeout: float) -> int:
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:  # Expired between add and incr.
+        cache.add(key, 1, timeout)
+        return 1
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker with its state kept in the Django cache.
+    """
+
+    def __init__(self, name: str, threshold: int, window: float, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.prefix = f"breaker:{name}"
+
+    def key(self, name: str) -> str:
+        return f"{self.prefix}:{name}"
+
+    @property
+    def state(self) -> str:
+        if cache.get(self.key("open")):
+            return OPEN
+        if cache.get(self.key("tripped")):
+            return HALF_OPEN
+        return CLOSED
+
+    def allow(self) -> bool:
+        """
+        Return whether a call may go upstream. While the breaker is open, and
+        while a half-open probe is in flight, calls are short-circuited and
+        counted.
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and cache.add(self.key("probe"), True, self.cooldown):
+            return True
+        _increment(self.key("short-circuited"), None)
+        return False
+
+    def record_success(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Circuit %s closed", self.name)
+        cache.delete_many(
+            [self.key("failures"), self.key("tripped"), self.key("probe")]
+        )
+
+    def record_failure(self) -> None:
+        failures = _increment(self.key("failures"), self.window)
+        if failures >= self.threshold or self.state == HALF_OPEN:
+            cache.set(self.key("open"), True, self.cooldown)
+            cache.set(self.key("tripped"), True, None)
+            cache.delete_many([self.key("failures"), self.key("probe")])
+            logger.warning(
+                "Circuit %s opened for %ss after %s failures",
+                self.name,
+                self.cooldown,
+                failures,
+            )
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": cache.get(self.key("failures"), 0),
+            "short_circuited": cache.get(self.key("short-circuited"), 0),
+        }
+
+
+class RetryBudget:
+    """
+    Allow at most ``minimum`` retries plus ``ratio`` retries per call made
+    within the current ``window`` seconds.
+    """
+
+    def __init__(self, name: str, ratio: float, minimum: int, window: float):
+        self.name = name
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+
+    def key(self, name: str) -> str:
+        return f"retry-budget:{self.name}:{name}:{int(time.time() // self.window)}"
+
+    def record_call(self) -> None:
+        _increment(self.key("calls"), self.window * 2)
+
+    def take(self) -> bool:
+        """
+        Spend one retry. Returns ``False`` when the budget is exhausted.
+        """
+        calls = cache.get(self.key("calls"), 0)
+        retries = _increment(self.key("retries"), self.window * 2)
+        return retries <= self.minimum + self.ratio * calls
+
+    def metrics(self) -> dict:
+        return {
+            "calls": cache.get(self.key("calls"), 0),
+            "retries": cache.get(self.key("retries"), 0),
+        }
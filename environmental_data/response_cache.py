@@ -0,0 +1,161 @@
+"""
+Versioned cache for the responses of the historical API endpoints.
+
+Responses are cached under the normalized request filters and the current
+dataset generation, which also makes up their ETag. Imports, ingestion and
+edits of the dimension tables bump the generation, which invalidates every
+cached response and ETag at once without scanning keys; the stale entries
+simply expire.
+
+The cache backend is the ``CACHES`` alias named by ``RESPONSE_CACHE_ALIAS``.
+It must be shared by every process, such as Redis, because the counters
+kept in it are how one process learns about changes made by another; a
+process-local backend fails the ``environmental_data.E001`` check.
+"""
+
+import hashlib
+import json
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Country, HistoricalEnvironmentalRecord, Sector, Substance
+
+GENERATION_KEY = "dataset-generation"
+MODIFIED_KEY = "dataset-modified"
+RECORDS_VERSION_KEY = "records-version"
+
+
+def response_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def counter(key: str) -> int:
+    """
+    Return the shared counter ``key``. A missing counter (evicted or never
+    set) starts from the current time, so it never repeats an earlier value.
+    """
+    cache = response_cache()
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump_counter(key: str) -> None:
+    """
+    Increment the shared counter ``key`` once the current transaction
+    commits.
+    """
+
+    def bump():
+        cache = response_cache()
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+    transaction.on_commit(bump)
+
+
+def generation() -> int:
+    """
+    Return the current dataset generation.
+    """
+    return counter(GENERATION_KEY)
+
+
+def bump_generation() -> None:
+    """
+    Invalidate all cached responses once the current transaction commits.
+    """
+    bump_counter(GENERATION_KEY)
+    transaction.on_commit(
+        lambda: response_cache().set(MODIFIED_KEY, int(time.time()), None)
+    )
+
+
+def records_version() -> int:
+    """
+    Return the version of the historical records and of the dimension
+    names they are served with. Unlike the generation, it does not move
+    when dimensions are only added.
+    """
+    return counter(RECORDS_VERSION_KEY)
+
+
+def bump_records_version() -> None:
+    """
+    Mark the historical records as changed once the current transaction
+    commits.
+    """
+    bump_counter(RECORDS_VERSION_KEY)
+
+
+def last_modified() -> int:
+    """
+    Return the time of the last generation bump as a Unix timestamp, or
+    the time it was first asked for if none was recorded.
+    """
+    cache = response_cache()
+    cache.add(MODIFIED_KEY, int(time.time()), None)
+    return cache.get(MODIFIED_KEY)
+
+
+def params_digest(namespace: str, params: dict) -> str:
+    return hashlib.sha1(
+        json.dumps([namespace, params], sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def response_key(namespace: str, params: dict) -> str:
+    return f"response:{generation()}:{params_digest(namespace, params)}"
+
+
+def response_etag(namespace: str, params: dict) -> str:
+    """
+    Return an ETag for the response to ``params`` at the current
+    generation. It changes whenever the dataset generation does.
+    """
+    return f'"{generation()}-{params_digest(namespace, params)[:16]}"'
+
+
+def cached_response(namespace: str, params: dict, build: Callable):
+    """
+    Return the data built by ``build`` for ``params``, computing it only if
+    it is not cached for the current generation. Exceptions raised by
+    ``build`` (e.g. ``NotFound``) are not cached.
+    """
+    cache = response_cache()
+    key = response_key(namespace, params)
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.RESPONSE_CACHE_TTL)
+    return data
+
+
+@receiver(post_save, sender=HistoricalEnvironmentalRecord)
+@receiver(post_delete, sender=HistoricalEnvironmentalRecord)
+def invalidate_records(sender, **kwargs):
+    bump_records_version()
+    bump_generation()
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+@receiver(post_save, sender=Sector)
+@receiver(post_delete, sender=Sector)
+@receiver(post_save, sender=Substance)
+@receiver(post_delete, sender=Substance)
+def invalidate_responses(sender, created=False, **kwargs):
+    if not created:
+        # Renaming or deleting a dimension changes the records as served.
+        bump_records_version()
+    bump_generation()
@@ -0,0 +1,70 @@
+"""
+Maintenance of the ``CountryYearTotal`` rollup.
+
+The importer refreshes the totals of the countries and years it wrote in
+the same transaction as the records. Records saved or deleted one at a time
+(admin, shell) refresh their total through model signals.
+"""
+
+from typing import Iterable
+
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CountryYearTotal, HistoricalEnvironmentalRecord
+
+
+def refresh_totals(
+    substance_id: int, country_ids: Iterable[int], years: Iterable[int]
+) -> int:
+    """
+    Recompute the totals of ``substance_id`` for every combination of
+    ``country_ids`` and ``years``. Totals whose records are all gone are
+    removed.
+
+    Returns:
+        int: Number of totals written.
+    """
+    country_ids, years = set(country_ids), set(years)
+    if not country_ids or not years:
+        return 0
+
+    totals = (
+        HistoricalEnvironmentalRecord.objects.filter(
+            substance_id=substance_id, country_id__in=country_ids, year__in=years
+        )
+        .order_by()
+        .values_list("country_id", "year")
+        .annotate(total=Sum("value"))
+    )
+    rows = [
+        CountryYearTotal(
+            country_id=country_id, substance_id=substance_id, year=year, total=total
+        )
+        for country_id, year, total in totals
+    ]
+    CountryYearTotal.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["country", "substance", "year"],
+        update_fields=["total"],
+    )
+
+    current = {(row.country_id, row.year) for row in rows}
+    stale = [
+        pk
+        for pk, country_id, year in CountryYearTotal.objects.filter(
+            substance_id=substance_id, country_id__in=country_ids, year__in=years
+        ).values_list("pk", "country_id", "year")
+        if (country_id, year) not in current
+    ]
+    if stale:
+        CountryYearTotal.objects.filter(pk__in=stale).delete()
+    return len(rows)
+
+
+@receiver(post_save, sender=HistoricalEnvironmentalRecord)
+@receiver(post_delete, sender=HistoricalEnvironmentalRecord)
+def refresh_record_total(sender, instance, **kwargs):
+    refresh_totals(instance.substance_id, [instance.country_id], [instance.year])
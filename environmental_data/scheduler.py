@@ -0,0 +1,155 @@
+"""
+Adaptive polling schedule for the realtime zones.
+
+Every zone gets a ``ZonePollState`` with the learned number of seconds
+between its upstream updates. The interval starts from the gaps between the
+zone's stored readings and follows the gaps between the ``updatedAt`` times
+seen upstream. A zone is polled shortly after its next update is expected.
+Polls that find nothing new back the zone off exponentially, and every poll
+time gets a random jitter so zones do not hit the API in bursts.
+"""
+
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from .models import RealtimeEnvironmentalRecord, ZonePollState
+
+# Weight of the newest observed gap in the learned interval.
+SMOOTHING = 0.3
+
+
+def clamp_interval(seconds: float) -> float:
+    return min(
+        max(seconds, settings.REALTIME_POLL_MIN_INTERVAL),
+        settings.REALTIME_POLL_MAX_INTERVAL,
+    )
+
+
+def learn_cadences(zones: list[str], now: datetime) -> dict:
+    """
+    Estimate the update interval of ``zones`` as the median gap between
+    their readings stored within ``REALTIME_CADENCE_WINDOW`` seconds.
+
+    Returns:
+        dict: Interval in seconds per zone with at least two readings.
+    """
+    timestamps = defaultdict(list)
+    for zone, timestamp in (
+        RealtimeEnvironmentalRecord.objects.filter(
+            country__code__in=zones,
+            timestamp__gte=now - timedelta(seconds=settings.REALTIME_CADENCE_WINDOW),
+        )
+        .order_by("timestamp")
+        .values_list("country__code", "timestamp")
+    ):
+        timestamps[zone].append(timestamp.timestamp())
+
+    cadences = {}
+    for zone, values in timestamps.items():
+        gaps = np.diff(values)
+        gaps = gaps[gaps > 0]
+        if len(gaps):
+            cadences[zone] = clamp_interval(float(np.median(gaps)))
+    return cadences
+
+
+def next_poll_time(
+    interval: float,
+    updated_at: Optional[datetime],
+    quiet_polls: int,
+    now: datetime,
+) -> datetime:
+    """
+    Return when to poll a zone next: ``REALTIME_POLL_DELAY`` seconds after
+    its next expected update, or after an exponential back-off once polls
+    stop finding new readings.
+    """
+    jitter = timedelta(
+        seconds=random.uniform(0, settings.REALTIME_POLL_JITTER * interval)
+    )
+    if not quiet_polls and updated_at is not None:
+        expected = updated_at + timedelta(
+            seconds=interval + settings.REALTIME_POLL_DELAY
+        )
+        if expected > now:
+            return expected + jitter
+
+    backoff = min(
+        settings.REALTIME_POLL_MIN_INTERVAL * 2**quiet_polls,
+        settings.REALTIME_POLL_MAX_INTERVAL,
+    )
+    return now + timedelta(seconds=backoff) + jitter
+
+
+def due_zones(zones: list[str], now: datetime) -> list[str]:
+    """
+    Return the zones of ``zones`` that are due, including zones that were
+    never polled.
+    """
+    scheduled = set(
+        ZonePollState.objects.filter(zone__in=zones, next_poll_at__gt=now).values_list(
+            "zone", flat=True
+        )
+    )
+    return [zone for zone in zones if zone not in scheduled]
+
+
+def update_time(data: dict) -> Optional[datetime]:
+    """
+    Return when upstream published a latest-reading payload, falling back
+    to the time of the reading.
+    """
+    return parse_datetime(data.get("updatedAt") or data.get("datetime") or "")
+
+
+def record_polls(zones: list[str], readings: dict, now: datetime) -> None:
+    """
+    Update the schedule of the polled ``zones`` from their ``readings``
+    (payload per zone that answered) and plan their next poll.
+    """
+    states = {
+        state.zone: state for state in ZonePollState.objects.filter(zone__in=zones)
+    }
+    new_zones = [zone for zone in zones if zone not in states]
+    cadences = learn_cadences(new_zones, now) if new_zones else {}
+    for zone in new_zones:
+        states[zone] = ZonePollState(
+            zone=zone,
+            interval=cadences.get(zone, settings.REALTIME_POLL_DEFAULT_INTERVAL),
+        )
+
+    for zone in zones:
+        state = states[zone]
+        updated_at = update_time(readings[zone]) if zone in readings else None
+        if updated_at is None or updated_at == state.last_updated_at:
+            state.quiet_polls += 1
+        else:
+            if state.last_updated_at and updated_at > state.last_updated_at:
+                gap = (updated_at - state.last_updated_at).total_seconds()
+                state.interval = clamp_interval(
+                    (1 - SMOOTHING) * state.interval + SMOOTHING * gap
+                )
+            state.last_updated_at = updated_at
+            state.last_reading_at = parse_datetime(readings[zone].get("datetime") or "")
+            state.quiet_polls = 0
+        state.next_poll_at = next_poll_time(
+            state.interval, state.last_updated_at, state.quiet_polls, now
+        )
+
+    ZonePollState.objects.bulk_create([states[zone] for zone in new_zones])
+    ZonePollState.objects.bulk_update(
+        [states[zone] for zone in zones if zone not in new_zones],
+        [
+            "interval",
+            "last_reading_at",
+            "last_updated_at",
+            "quiet_polls",
+            "next_poll_at",
+        ],
+    )
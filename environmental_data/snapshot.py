@@ -0,0 +1,251 @@
+"""
+Columnar snapshot of ``HistoricalEnvironmentalRecord`` for analytical reads.
+
+The table is exported to one ``.npy`` file per column: dictionary-encoded
+country, sector and substance codes plus the year and value columns. Web
+workers open the files with ``mmap_mode="r"``, so loading is zero-copy and
+the pages are shared through the OS page cache by every process.
+
+Each export is written to a fresh generation directory and published by
+atomically replacing the ``CURRENT`` pointer file. Readers notice the new
+generation on their next request.
+
+A snapshot is stamped with the records version of ``response_cache`` it
+was exported at. Saving or deleting a record, or renaming or deleting a
+dimension, outside the importer moves the version on, and readers ignore
+the snapshot (falling back to the database) until the next export. Adding
+dimensions, as ingestion of a new zone does, leaves the snapshot valid.
+"""
+
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from .models import HistoricalEnvironmentalRecord, Country, Sector, Substance
+from .response_cache import records_version
+
+COLUMNS = {
+    "country": np.int16,
+    "sector": np.int16,
+    "substance": np.int16,
+    "year": np.int16,
+    "value": np.float64,
+}
+POINTER_FILE = "CURRENT"
+META_FILE = "meta.json"
+EXPORT_CHUNK_SIZE = 50000
+
+
+def snapshot_dir() -> Path:
+    return Path(settings.HISTORICAL_SNAPSHOT_DIR)
+
+
+def database_name() -> str:
+    """
+    Identify the database a snapshot was taken from, so a snapshot of one
+    database (e.g. the development one) is never served for another.
+    """
+    return str(connection.settings_dict["NAME"])
+
+
+def _encode(ids: np.ndarray, dictionary: list, name: str) -> np.ndarray:
+    """
+    Replace primary keys with their position in ``dictionary``.
+
+    Raises:
+        ValueError: If some ids are not in ``dictionary``.
+    """
+    keys = [row[0] for row in dictionary]
+    lookup = np.full(max(keys + [int(ids.max(initial=0))]) + 1, -1)
+    lookup[keys] = np.arange(len(dictionary))
+    codes = lookup[ids]
+    if (codes < 0).any():
+        missing = np.unique(ids[codes < 0])[:10].tolist()
+        raise ValueError(
+            f"Historical records reference {name} ids missing from the "
+            f"{name} table: {missing}"
+        )
+    return codes
+
+
+def export_snapshot(directory=None) -> Path:
+    """
+    Export ``HistoricalEnvironmentalRecord`` as a new snapshot generation
+    and publish it. Older generations are removed; processes that still
+    have them mapped keep reading until they pick up the new one.
+
+    Returns:
+        Path: Directory of the published generation.
+    """
+    directory = Path(directory or snapshot_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+
+    stamp = records_version()
+    countries = list(Country.objects.order_by("id").values_list("id", "code", "name"))
+    sectors = list(Sector.objects.order_by("id").values_list("id", "name"))
+    substances = list(Substance.objects.order_by("id").values_list("id", "name"))
+
+    rows = np.fromiter(
+        HistoricalEnvironmentalRecord.objects.order_by(
+            "country_id", "sector_id", "substance_id", "year"
+        )
+        .values_list("country_id", "sector_id", "substance_id", "year", "value")
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE),
+        dtype=[(name, np.int64 if name != "value" else np.float64) for name in COLUMNS],
+    )
+    columns = {
+        "country": _encode(rows["country"], countries, "country"),
+        "sector": _encode(rows["sector"], sectors, "sector"),
+        "substance": _encode(rows["substance"], substances, "substance"),
+        "year": rows["year"],
+        "value": rows["value"],
+    }
+
+    generation = f"gen-{time.time_ns()}"
+    staging = directory / f".{generation}"
+    staging.mkdir()
+    for name, dtype in COLUMNS.items():
+        np.save(staging / f"{name}.npy", columns[name].astype(dtype))
+    meta = {
+        "database": database_name(),
+        "records_version": stamp,
+        "rows": len(rows),
+        "countries": [[code, name] for _, code, name in countries],
+        "sectors": [name for _, name in sectors],
+        "substances": [name for _, name in substances],
+    }
+    (staging / META_FILE).write_text(json.dumps(meta))
+    staging.rename(directory / generation)
+
+    pointer = directory / f".{POINTER_FILE}"
+    pointer.write_text(generation)
+    os.replace(pointer, directory / POINTER_FILE)
+
+    for old in directory.glob("gen-*"):
+        if old.name != generation:
+            shutil.rmtree(old, ignore_errors=True)
+    return directory / generation
+
+
+class HistoricalSnapshot:
+    """
+    Read-only view of one snapshot generation.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        meta = json.loads((path / META_FILE).read_text())
+        self.database = meta["database"]
+        self.records_version = meta.get("records_version")
+        self.country_codes = np.array([code for code, _ in meta["countries"]])
+        self.country_names = np.array([name for _, name in meta["countries"]])
+        self.sector_names = np.array(meta["sectors"])
+        self.substance_names = np.array(meta["substances"])
+        for name in COLUMNS:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+
+    def __len__(self):
+        return len(self.year)
+
+    def select(
+        self,
+        country_names=None,
+        sectors=None,
+        substance=None,
+        start_year=None,
+        end_year=None,
+    ) -> np.ndarray:
+        """
+        Return the row indices matching the filters. ``country_names`` and
+        ``sectors`` match exactly, ``substance`` case-insensitively.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if country_names:
+            wanted = np.flatnonzero(np.isin(self.country_names, country_names))
+            mask &= np.isin(self.country, wanted)
+        if sectors:
+            wanted = np.flatnonzero(np.isin(self.sector_names, sectors))
+            mask &= np.isin(self.sector, wanted)
+        if substance:
+            wanted = np.flatnonzero(
+                np.char.lower(self.substance_names) == substance.lower()
+            )
+            mask &= np.isin(self.substance, wanted)
+        if start_year is not None:
+            mask &= self.year >= int(start_year)
+        if end_year is not None:
+            mask &= self.year <= int(end_year)
+        return np.flatnonzero(mask)
+
+    def grouped(self, rows: np.ndarray) -> dict:
+        """
+        Nest the values of ``rows`` as ``{country: {sector: {year: value}}}``,
+        most recent year first.
+        """
+        rows = rows[np.argsort(-self.year[rows], kind="stable")]
+        response_data = {}
+        for country, sector, year, value in zip(
+            self.country_names[self.country[rows]].tolist(),
+            self.sector_names[self.sector[rows]].tolist(),
+            self.year[rows].tolist(),
+            self.value[rows].tolist(),
+        ):
+            response_data.setdefault(country, {}).setdefault(sector, {})[year] = value
+        return response_data
+
+    def totals(self, rows: np.ndarray) -> dict:
+        """
+        Sum the values of ``rows`` per country and year as
+        ``{country: {"Total": {year: value}}}``, most recent year first.
+        """
+        if not len(rows):
+            return {}
+
+        keys = np.stack([self.country[rows], -self.year[rows].astype(np.int32)])
+        groups, inverse = np.unique(keys, axis=1, return_inverse=True)
+        sums = np.bincount(inverse.ravel(), weights=self.value[rows])
+
+        response_data = {}
+        for country, year, value in zip(
+            self.country_names[groups[0]].tolist(),
+            (-groups[1]).tolist(),
+            sums.tolist(),
+        ):
+            response_data.setdefault(country, {"Total": {}})["Total"][year] = value
+        return response_data
+
+
+_loaded = {"key": None, "snapshot": None}
+
+
+def load_snapshot() -> HistoricalSnapshot | None:
+    """
+    Return the current snapshot for this database, or ``None`` if there is
+    none or the dataset changed since it was exported. The mapping is
+    cached per process and replaced when a new generation is published.
+    """
+    directory = snapshot_dir()
+    try:
+        generation = (directory / POINTER_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+
+    if _loaded["key"] != (directory, generation):
+        try:
+            snapshot = HistoricalSnapshot(directory / generation)
+        except FileNotFoundError:
+            return None
+        _loaded.update(key=(directory, generation), snapshot=snapshot)
+
+    snapshot = _loaded["snapshot"]
+    if snapshot.database != database_name():
+        return None
+    if snapshot.records_version != records_version():
+        return None
+    return snapshot
@@ -1,11 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-import os
-from venv import logger
+import logging
+import time
 import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+from . import dimensions, electricitymap, scheduler
+from .buffer import FLUSH_LOCK_KEY, METRICS_KEY, get_buffer
+from .ratelimit import take_token
 from .models import (
-    Country,
-    Sector,
-    Substance,
+    BackfillWindow,
     RealtimeEnvironmentalRecord,
 )
 from django.utils import timezone
@@ -15,6 +21,162 @@ from celery import shared_task
 
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
+
+def fetch_latest_carbon_intensity(country_code: str) -> tuple[int, dict]:
+    """
+    Request the latest carbon intensity for ``country_code`` from the
+    ElectricityMap API, through the shared response cache.
+
+    Args:
+        country_code (str): The country code to fetch data for.
+
+    Returns:
+        tuple[int, dict]: The HTTP status code and the decoded payload.
+    """
+    return electricitymap.get_json(
+        "carbon-intensity/latest", params={"zone": country_code}
+    )
+
+
+def last_reading_key(country_code: str) -> str:
+    return f"electricitymap:last-reading:{country_code}"
+
+
+def reading_timestamp(data: dict) -> datetime:
+    """
+    Return the upstream time of a latest-reading payload, or now if the
+    payload does not carry one.
+    """
+    timestamp = parse_datetime(data.get("datetime") or "")
+    return timestamp or timezone.now()
+
+
+def insert_readings(readings: list[dict]) -> dict:
+    """
+    Store realtime readings with one read and one bulk insert, skipping
+    readings that are already stored or repeated within ``readings``.
+
+    A dimension id cached before its row was deleted elsewhere fails the
+    insert with an ``IntegrityError``; the dimension caches are then
+    cleared and the insert is retried once.
+
+    Args:
+        readings (list[dict]): Readings with the keys ``zone``, ``name``,
+            ``timestamp`` and ``value``.
+
+    Returns:
+        dict: Status per ``(zone, timestamp)``, ``"ok"``, ``"unchanged"``
+        or a failure reason.
+    """
+    try:
+        with transaction.atomic():
+            return _insert_readings(readings)
+    except IntegrityError:
+        logger.warning("Stale dimension ids in the cache, retrying the insert")
+        dimensions.clear_all()
+        with transaction.atomic():
+            return _insert_readings(readings)
+
+
+def _insert_readings(readings: list[dict]) -> dict:
+    points = {(reading["zone"], reading["timestamp"]): reading for reading in readings}
+    countries = dimensions.countries.get_many(
+        {zone for zone, _ in points},
+        defaults={reading["zone"]: {"name": reading["name"]} for reading in readings},
+    )
+    substance_id = dimensions.substances.get("CO2")
+    sector_id = dimensions.sectors.get("Total Emissions")
+    stored = set(
+        RealtimeEnvironmentalRecord.objects.filter(
+            country_id__in=countries.values(),
+            substance_id=substance_id,
+            timestamp__in={timestamp for _, timestamp in points},
+        ).values_list("country_id", "timestamp")
+    )
+
+    statuses = {}
+    records = []
+    for (zone, timestamp), reading in points.items():
+        if zone not in countries:
+            statuses[zone, timestamp] = "failed: could not create country"
+        elif (countries[zone], timestamp) in stored:
+            statuses[zone, timestamp] = "unchanged"
+        else:
+            statuses[zone, timestamp] = "ok"
+            records.append(
+                RealtimeEnvironmentalRecord(
+                    country_id=countries[zone],
+                    substance_id=substance_id,
+                    sector_id=sector_id,
+                    value=reading["value"],
+                    timestamp=timestamp,
+                )
+            )
+
+    RealtimeEnvironmentalRecord.objects.bulk_create(records, ignore_conflicts=True)
+    return statuses
+
+
+def store_latest_readings(readings: dict) -> dict:
+    """
+    Store the latest-reading payloads of many zones with one bulk insert,
+    or push them to the write-behind buffer if ``REALTIME_WRITE_BEHIND`` is
+    enabled.
+
+    Each reading is stored at its upstream ``datetime``. Readings whose
+    datetime matches the last stored reading of the zone are not written
+    again; the last stored datetime is remembered in the cache so unchanged
+    zones cost no database query.
+
+    Args:
+        readings (dict): Payload per zone code.
+
+    Returns:
+        dict: Status per zone, ``"ok"``, ``"buffered"`` or ``"unchanged"``.
+    """
+    statuses = {}
+    fresh = []
+    for zone, data in readings.items():
+        timestamp = reading_timestamp(data)
+        if cache.get(last_reading_key(zone)) == timestamp:
+            statuses[zone] = "unchanged"
+        else:
+            fresh.append(
+                {
+                    "zone": zone,
+                    "name": data.get("zoneName", zone),
+                    "timestamp": timestamp,
+                    "value": data["carbonIntensity"],
+                }
+            )
+
+    if not fresh:
+        return statuses
+
+    if settings.REALTIME_WRITE_BEHIND:
+        get_buffer().push(
+            [
+                {**reading, "timestamp": reading["timestamp"].isoformat()}
+                for reading in fresh
+            ]
+        )
+        statuses.update({reading["zone"]: "buffered" for reading in fresh})
+    else:
+        inserted = insert_readings(fresh)
+        statuses.update({zone: status for (zone, _), status in inserted.items()})
+
+    cache.set_many(
+        {
+            last_reading_key(reading["zone"]): reading["timestamp"]
+            for reading in fresh
+            if not statuses[reading["zone"]].startswith("failed")
+        },
+        settings.LAST_READING_TTL,
+    )
+    return statuses
+
 
 @shared_task
 def fetch_realtime_carbon_data(country_code: str) -> None:
@@ -28,44 +190,248 @@ def fetch_realtime_carbon_data(country_code: str) -> None:
     Returns:
         None
     """
-    api_key: Optional[str] = os.getenv("ELECTRICITY_MAP_API_KEY")
-    headers: dict = {"Authorization": f"Bearer {api_key}"}
-    url: str = (
-        "https://api.electricitymap.org/"
-        f"v3/carbon-intensity/latest?zone={country_code}"
-    )
+    status_code, data = fetch_latest_carbon_intensity(country_code)
 
-    response: requests.Response = requests.get(url, headers=headers)
-    data: dict = response.json()
-
-    if response.status_code == 200 and "carbonIntensity" in data:
-
-        country, _ = Country.objects.get_or_create(
-            code=country_code, defaults={"name": data.get("zoneName", country_code)}
-        )
-        substance, _ = Substance.objects.get_or_create(name="CO2")
-        sector, _ = Sector.objects.get_or_create(name="Total Emissions")
-        RealtimeEnvironmentalRecord.objects.create(
-            country=country,
-            substance=substance,
-            sector=sector,
-            value=data["carbonIntensity"],
-            timestamp=timezone.now(),
-        )
+    if status_code == 200 and "carbonIntensity" in data:
+        status = store_latest_readings({country_code: data})[country_code]
         print(
             f"Fetched data for country \
-                {country_code}: {response.status_code}"
+                {country_code}: {status_code} ({status})"
         )
     else:
         print(
             f"Failed to fetch data for country \
-                {country_code}: {response.status_code}"
+                {country_code}: {status_code}"
         )
 
 
+def poll_zones(zones: list[str], max_concurrency: Optional[int] = None) -> tuple:
+    """
+    Fetch the latest carbon intensity for many zones concurrently and store
+    all readings with a single bulk insert.
+
+    Returns:
+        tuple[dict, dict]: Status per zone and the payload per zone that
+        answered with a reading.
+    """
+    if not zones:
+        return {}, {}
+    max_concurrency = max_concurrency or settings.REALTIME_FETCH_CONCURRENCY
+
+    def fetch(zone):
+        try:
+            return fetch_latest_carbon_intensity(zone)
+        except requests.RequestException as error:
+            return None, {"error": str(error)}
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(zones))) as pool:
+        responses = dict(zip(zones, pool.map(fetch, zones)))
+
+    statuses = {}
+    readings = {}
+    for zone, (status_code, data) in responses.items():
+        if status_code == 200 and "carbonIntensity" in data:
+            readings[zone] = data
+        elif status_code is None:
+            statuses[zone] = f"error: {data['error']}"
+        else:
+            statuses[zone] = f"failed: {status_code}"
+
+    if readings:
+        statuses.update(store_latest_readings(readings))
+    return {zone: statuses[zone] for zone in zones}, readings
+
+
+@shared_task
+def fetch_realtime_emissions(
+    zones: Optional[list[str]] = None, max_concurrency: Optional[int] = None
+) -> dict:
+    """
+    Fetch the latest carbon intensity for many zones concurrently and store
+    all readings with a single bulk insert.
+
+    Args:
+        zones (list[str], optional): Zone codes to fetch. Defaults to
+            ``settings.REALTIME_ZONES``.
+        max_concurrency (int, optional): Maximum number of requests in
+            flight. Defaults to ``settings.REALTIME_FETCH_CONCURRENCY``.
+
+    Returns:
+        dict: Status per zone, ``"ok"``, ``"unchanged"`` or a short failure
+        reason.
+    """
+    statuses, _ = poll_zones(zones or settings.REALTIME_ZONES, max_concurrency)
+    return statuses
+
+
+@shared_task
+def poll_due_zones(zones: Optional[list[str]] = None) -> dict:
+    """
+    Poll the zones whose next upstream update is expected by now and plan
+    their next poll. Beat runs this every ``REALTIME_SCHEDULER_TICK``
+    seconds.
+
+    Args:
+        zones (list[str], optional): Zone codes to schedule. Defaults to
+            ``settings.REALTIME_ZONES``.
+
+    Returns:
+        dict: Status per polled zone.
+    """
+    now = timezone.now()
+    due = scheduler.due_zones(zones or settings.REALTIME_ZONES, now)
+    if not due:
+        return {}
+
+    statuses, readings = poll_zones(due)
+    scheduler.record_polls(due, readings, now)
+    return statuses
+
+
+@shared_task
+def flush_realtime_buffer() -> dict:
+    """
+    Drain the write-behind buffer into the database.
+
+    Claimed readings are stored in batches of ``REALTIME_BUFFER_BATCH_SIZE``
+    and acknowledged once all batches are stored, so a flush that fails is
+    delivered again by the next one. Only one flush runs at a time.
+
+    Returns:
+        dict: Readings ``flushed`` and ``inserted``, the flush latency in
+        ``seconds`` and the buffer ``depth`` left.
+    """
+    buffer = get_buffer()
+    if not cache.add(FLUSH_LOCK_KEY, True, settings.REALTIME_BUFFER_FLUSH_TIMEOUT):
+        return {"flushed": 0, "inserted": 0, "seconds": 0.0, "depth": buffer.depth()}
+
+    started = time.monotonic()
+    try:
+        claimed = buffer.claim()
+        inserted = 0
+        batch_size = settings.REALTIME_BUFFER_BATCH_SIZE
+        for offset in range(0, len(claimed), batch_size):
+            batch = [
+                {**reading, "timestamp": parse_datetime(reading["timestamp"])}
+                for reading in claimed[offset : offset + batch_size]  # noqa: E203
+            ]
+            statuses = insert_readings(batch)
+            inserted += sum(status == "ok" for status in statuses.values())
+        buffer.ack()
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+    metrics = {
+        "flushed": len(claimed),
+        "inserted": inserted,
+        "seconds": round(time.monotonic() - started, 3),
+        "depth": buffer.depth(),
+        "finished_at": timezone.now().isoformat(),
+    }
+    cache.set(METRICS_KEY, metrics, None)
+    logger.info(
+        "Flushed %(flushed)s buffered readings (%(inserted)s new) in "
+        "%(seconds)ss, %(depth)s left",
+        metrics,
+    )
+    return metrics
+
+
+def fetch_carbon_history(
+    country_code: str, start: datetime, end: datetime, time_step: str = "hour"
+) -> tuple[int, dict]:
+    """
+    Request the carbon intensity history of ``country_code`` between
+    ``start`` and ``end`` from the ElectricityMap API, through the shared
+    response cache.
+
+    Returns:
+        tuple[int, dict]: The HTTP status code and the decoded payload.
+    """
+    return electricitymap.get_json(
+        "carbon-intensity/history",
+        params={
+            "zone": country_code,
+            "from": int(start.timestamp()),
+            "to": int(end.timestamp()),
+            "time_step": time_step,
+        },
+    )
+
+
+def history_dimensions(country_code: str, data: dict) -> tuple[int, int, int]:
+    """
+    Resolve the country, substance and sector ids that realtime readings of
+    ``country_code`` are stored under.
+    """
+    return (
+        dimensions.countries.get(
+            country_code, defaults={"name": data.get("zoneName", country_code)}
+        ),
+        dimensions.substances.get("CO2"),
+        dimensions.sectors.get("Total Emissions"),
+    )
+
+
+def store_carbon_history(
+    country_id: int, substance_id: int, sector_id: int, entries: list[dict]
+) -> dict:
+    """
+    Store the carbon intensity history ``entries`` of one country, skipping
+    points that are already stored.
+
+    The stored timestamps of the covered window are loaded with one query
+    and the missing points are inserted with one batched write. The unique
+    constraint on (country, substance, timestamp) makes concurrent writers
+    of the same window skip each other's rows instead of duplicating them.
+
+    Returns:
+        dict: Number of points ``inserted`` and ``skipped``.
+    """
+    points = {}
+    for entry in entries:
+        if entry["timestamp"] is None:
+            logger.warning("Received None timestamp from the API. Skipping entry.")
+            continue
+        timestamp = datetime.fromtimestamp(entry["timestamp"], tz=tz.utc)
+        points[timestamp] = entry["carbonIntensity"]
+
+    if points:
+        existing = set(
+            RealtimeEnvironmentalRecord.objects.filter(
+                country_id=country_id,
+                substance_id=substance_id,
+                timestamp__gte=min(points),
+                timestamp__lte=max(points),
+            ).values_list("timestamp", flat=True)
+        )
+        new_points = {
+            timestamp: value
+            for timestamp, value in points.items()
+            if timestamp not in existing
+        }
+        RealtimeEnvironmentalRecord.objects.bulk_create(
+            [
+                RealtimeEnvironmentalRecord(
+                    country_id=country_id,
+                    substance_id=substance_id,
+                    sector_id=sector_id,
+                    value=value,
+                    timestamp=timestamp,
+                )
+                for timestamp, value in new_points.items()
+            ],
+            ignore_conflicts=True,
+        )
+    else:
+        new_points = {}
+
+    return {"inserted": len(new_points), "skipped": len(entries) - len(new_points)}
+
+
 def fetch_recent_carbon_data(
     country_code: str, time_range_hours: int = 24, time_step: str = "hour"
-) -> None:
+) -> dict:
     """
     Fetches historical carbon intensity data for the given country.
 
@@ -74,60 +440,135 @@ def fetch_recent_carbon_data(
     from the current time to fetch data. Defaults to 24.
     :param time_step: The granularity of the data ('hour', 'minute', 'day').
     Defaults to 'hour'.
+    :return: Number of points ``inserted`` and ``skipped``.
     """
 
-    api_key = os.getenv("ELECTRICITY_MAP_API_KEY")
+    now = datetime.now()
 
-    headers = {"Authorization": f"Bearer {api_key}"}
+    status_code, data = fetch_carbon_history(
+        country_code, now - timedelta(hours=time_range_hours), now, time_step
+    )
 
-    now = datetime.now()
+    if status_code == 200:
+        result = store_carbon_history(
+            *history_dimensions(country_code, data), data["data"]
+        )
 
-    from_timestamp = int((now - timedelta(hours=time_range_hours)).timestamp())
+        print(
+            f"Historical data fetched for country {country_code} from "
+            f"{time_range_hours} hours ago: {result['inserted']} inserted, "
+            f"{result['skipped']} skipped"
+        )
+        return result
 
-    to_timestamp = int(now.timestamp())
+    print(
+        f"Failed to fetch historical data for country \
+            {country_code}: {status_code}"
+    )
+    return {"inserted": 0, "skipped": 0}
 
-    url = f"https://api.electricitymap.org/v3/carbon-intensity/\
-        history?zone={country_code}&from={from_timestamp}&to={to_timestamp}\
-            &time_step={time_step}"
 
-    response = requests.get(url, headers=headers)
+def parse_utc(value: str) -> datetime:
+    """
+    Parse an ISO datetime, reading naive values as UTC.
+    """
+    parsed = datetime.fromisoformat(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, tz.utc)
 
-    if response.status_code == 200:
-        data = response.json()
 
-        country, _ = Country.objects.get_or_create(
-            code=country_code, defaults={"name": data.get("zoneName", country_code)}
-        )
+def plan_backfill(
+    zones: list[str],
+    start: datetime,
+    end: datetime,
+    window_hours: Optional[int] = None,
+) -> list[BackfillWindow]:
+    """
+    Split ``start``..``end`` into upstream-sized windows for every zone and
+    checkpoint them. Windows planned by an earlier run are kept as they are,
+    so re-planning the same range resumes it.
 
-        substance, _ = Substance.objects.get_or_create(name="CO2")
-        sector, _ = Sector.objects.get_or_create(name="Total Emissions")
+    Returns:
+        list[BackfillWindow]: The windows of the range that are not done yet.
+    """
+    step = timedelta(hours=window_hours or settings.BACKFILL_WINDOW_HOURS)
+    windows = []
+    for zone in zones:
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + step, end)
+            windows.append(
+                BackfillWindow(zone=zone, start=window_start, end=window_end)
+            )
+            window_start = window_end
 
-        for entry in data["data"]:
-            if entry["timestamp"] is None:
-                logger.warning("Received None timestamp from the API. Skipping entry.")
-                continue
+    BackfillWindow.objects.bulk_create(windows, ignore_conflicts=True)
+    return list(
+        BackfillWindow.objects.filter(
+            zone__in=zones, start__gte=start, end__lte=end
+        ).exclude(status=BackfillWindow.DONE)
+    )
 
-            timestamp = datetime.fromtimestamp(entry["timestamp"], tz=tz.utc)
 
-            carbon_intensity = entry["carbonIntensity"]
+@shared_task
+def start_backfill(
+    zones: list[str], start: str, end: str, window_hours: Optional[int] = None
+) -> int:
+    """
+    Plan a backfill of ``zones`` between the ISO datetimes ``start`` and
+    ``end`` (UTC) and queue every window that is not done yet.
 
-            if not RealtimeEnvironmentalRecord.objects.filter(
-                country=country, timestamp=timestamp
-            ).exists():
-                RealtimeEnvironmentalRecord.objects.create(
-                    country=country,
-                    substance=substance,
-                    value=carbon_intensity,
-                    timestamp=timestamp,
-                    sector=sector,
-                )
+    Returns:
+        int: Number of windows queued.
+    """
+    windows = plan_backfill(zones, parse_utc(start), parse_utc(end), window_hours)
+    for window in windows:
+        backfill_carbon_window.delay(window.pk)
+    return len(windows)
 
-        print(
-            f"Historical data fetched and saved for country \
-                {country_code} from {time_range_hours} hours ago"
-        )
-    else:
-        print(
-            f"Failed to fetch historical data for country \
-                {country_code}: {response.status_code}"
-        )
+
+@shared_task(bind=True, max_retries=None)
+def backfill_carbon_window(self, window_id: int) -> dict:
+    """
+    Fetch and store one backfill window.
+
+    The task waits for a token of the shared ``BACKFILL_RATE_PER_SECOND``
+    bucket before calling upstream. Failed fetches are retried with
+    exponential backoff up to ``BACKFILL_MAX_ATTEMPTS`` times.
+
+    Returns:
+        dict: Number of points ``inserted`` and ``skipped``.
+    """
+    window = BackfillWindow.objects.get(pk=window_id)
+    if window.status == BackfillWindow.DONE:
+        return {"inserted": 0, "skipped": 0}
+
+    wait = take_token(
+        "electricitymap-backfill",
+        settings.BACKFILL_RATE_PER_SECOND,
+        settings.BACKFILL_BURST,
+    )
+    if wait:
+        raise self.retry(countdown=wait)
+
+    window.attempts += 1
+    try:
+        status_code, data = fetch_carbon_history(window.zone, window.start, window.end)
+        error = "" if status_code == 200 else f"HTTP {status_code}"
+    except requests.RequestException as exc:
+        error = str(exc)[:200]
+
+    if error:
+        window.status = BackfillWindow.FAILED
+        window.error = error
+        window.save(update_fields=["status", "error", "attempts", "updated_at"])
+        if window.attempts < settings.BACKFILL_MAX_ATTEMPTS:
+            raise self.retry(countdown=2**window.attempts)
+        return {"inserted": 0, "skipped": 0}
+
+    result = store_carbon_history(*history_dimensions(window.zone, data), data["data"])
+
+    window.status = BackfillWindow.DONE
+    window.inserted = result["inserted"]
+    window.error = ""
+    window.save()
+    return result
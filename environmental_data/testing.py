@@ -0,0 +1,88 @@
+"""
+Test helpers for the query budgets of the API views.
+"""
+
+from itertools import product
+
+from django.core.cache import caches
+from rest_framework.test import APIRequestFactory
+
+from . import dimensions
+from .coverage import refresh_coverage
+from .instrumentation import track_queries, view_budget
+from .models import Country, HistoricalEnvironmentalRecord, Sector, Substance
+from .rollup import refresh_totals
+
+
+class QueryBudgetMixin:
+    """
+    ``TestCase`` mixin that fails a test when a view runs more queries than
+    its ``query_budget`` allows.
+
+    Budgets must not depend on the amount of data, so they are checked
+    against a dataset of fixed size seeded with ``seed_dataset``.
+    """
+
+    @classmethod
+    def seed_dataset(cls, countries=5, sectors=4, substances=2, years=10):
+        """
+        Create ``countries`` x ``sectors`` x ``substances`` x ``years``
+        historical records, their country totals and coverage.
+        """
+        cls.countries = Country.objects.bulk_create(
+            Country(name=f"Country {i}", code=f"C{i}") for i in range(countries)
+        )
+        cls.sectors = Sector.objects.bulk_create(
+            Sector(name=f"Sector {i}") for i in range(sectors)
+        )
+        cls.substances = Substance.objects.bulk_create(
+            Substance(name=f"Substance {i}") for i in range(substances)
+        )
+        cls.years = list(range(2000, 2000 + years))
+        HistoricalEnvironmentalRecord.objects.bulk_create(
+            HistoricalEnvironmentalRecord(
+                country=country,
+                sector=sector,
+                substance=substance,
+                year=year,
+                value=float(year),
+            )
+            for country, sector, substance, year in product(
+                cls.countries, cls.sectors, cls.substances, cls.years
+            )
+        )
+        country_ids = [country.id for country in cls.countries]
+        for substance in cls.substances:
+            refresh_totals(substance.id, country_ids, cls.years)
+            refresh_coverage(substance.id, country_ids)
+
+    def assertWithinQueryBudget(self, view_class, params=None, status=200):
+        """
+        Request ``view_class`` with ``params`` on cold caches and fail if it
+        runs more queries than its ``query_budget``. Streaming responses are
+        consumed within the count.
+
+        Returns:
+            The response.
+        """
+        view = view_class.as_view()
+        budget = view_budget(view)
+        self.assertIsNotNone(budget, f"{view_class.__name__} declares no budget")
+        for alias in caches:
+            caches[alias].clear()
+        dimensions.clear_all()
+
+        request = APIRequestFactory().get("/", params or {})
+        with track_queries(view_class.__name__) as stats:
+            response = view(request)
+            if response.streaming:
+                response.streaming_content = [b"".join(response.streaming_content)]
+
+        self.assertEqual(response.status_code, status)
+        self.assertLessEqual(
+            stats.count,
+            budget,
+            f"{view_class.__name__} ran {stats.count} queries for {params}, "
+            f"over its budget of {budget}",
+        )
+        return response
@@ -1,15 +1,58 @@
-import os
+import csv
+import gzip
+import json
+import tempfile
 from datetime import datetime, timedelta
+from io import StringIO
+from pathlib import Path
 from unittest.mock import patch, MagicMock
-from django.test import TestCase
+
+from celery.exceptions import Retry
+from celery.signals import task_postrun, task_prerun
+
+import requests
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from environmental_data import (
+    buffer,
+    catalog,
+    dimensions,
+    electricitymap,
+    resilience,
+)
+from environmental_data.bulk_load import (
+    drop_secondary_indexes,
+    restore_dropped_indexes,
+    secondary_indexes,
+)
 from environmental_data.models import (
+    BackfillWindow,
+    CountryYearTotal,
+    DroppedIndex,
+    HistoricalCoverage,
     RealtimeEnvironmentalRecord,
+    ZonePollState,
 )
 from environmental_data.tasks import (
+    backfill_carbon_window,
     fetch_realtime_carbon_data,
+    fetch_realtime_emissions,
     fetch_recent_carbon_data,
+    flush_realtime_buffer,
+    insert_readings,
+    plan_backfill,
+    poll_due_zones,
 )
 
 
@@ -19,7 +62,26 @@ from environmental_data.models import (
     Sector,
     Substance,
 )
-from environmental_data.views import CountryTotalDataView
+from environmental_data.checks import check_response_cache
+from environmental_data.downsample import lttb, minmax
+from environmental_data.ratelimit import take_token
+from environmental_data.response_cache import bump_generation
+from environmental_data.scheduler import record_polls
+from environmental_data.snapshot import export_snapshot, load_snapshot
+from environmental_data.views import (
+    CatalogView,
+    CountryListView,
+    CountryTotalDataView,
+    FilteredEnvironmentalDataView,
+    HistoricalCoverageView,
+    HistoricalExportView,
+    RealtimeSeriesView,
+    SectorListView,
+    SubstanceListView,
+    realtime_emissions_dashboard,
+)
+from environmental_data.instrumentation import QueryStatsMiddleware
+from environmental_data.testing import QueryBudgetMixin
 from rest_framework.test import APIRequestFactory
 
 
@@ -27,7 +89,10 @@ from datetime import timezone as tz
 
 
 class RealtimeCarbonDataTestCase(TestCase):
-    @patch("requests.get")
+    def setUp(self):
+        cache.clear()
+
+    @patch("requests.Session.get")
     def test_fetch_emissions_data_success(self, mock_get):
 
         mock_response = MagicMock()
@@ -47,8 +112,31 @@ class RealtimeCarbonDataTestCase(TestCase):
         self.assertIsNotNone(emission_record)
         self.assertEqual(emission_record.value, 100)
 
-    @patch("requests.get")
-    def test_fetch_carbon_data_failure(self, mock_get):
+    @patch("requests.Session.get")
+    def test_repeated_polls_share_upstream_call_and_row(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "carbonIntensity": 100,
+            "datetime": "2024-11-15T12:00:00Z",
+        }
+
+        fetch_realtime_carbon_data("DE")
+        fetch_realtime_carbon_data("DE")
+        self.assertEqual(mock_get.call_count, 1)
+
+        cache.delete(
+            electricitymap.cache_key("carbon-intensity/latest", {"zone": "DE"})
+        )
+        with self.assertNumQueries(0):
+            fetch_realtime_carbon_data("DE")
+
+        self.assertEqual(mock_get.call_count, 2)
+        record = RealtimeEnvironmentalRecord.objects.get()
+        self.assertEqual(record.timestamp, datetime(2024, 11, 15, 12, tzinfo=tz.utc))
+
+    @patch("environmental_data.electricitymap.time.sleep")
+    @patch("requests.Session.get")
+    def test_fetch_carbon_data_failure(self, mock_get, sleep):
         mock_response = MagicMock()
         mock_response.status_code = 500  # Internal Server Error
 
@@ -58,13 +146,17 @@ class RealtimeCarbonDataTestCase(TestCase):
 
         fetch_realtime_carbon_data(country_code)
 
-        mock_get.assert_called_once_with(
-            "https://api.electricitymap.org/v3/"
-            f"carbon-intensity/latest?zone={country_code}",
-            headers={"Authorization": f"Bearer {os.getenv('ELECTRICITY_MAP_API_KEY')}"},
+        self.assertEqual(mock_get.call_count, 1 + settings.ELECTRICITY_MAP_MAX_RETRIES)
+        mock_get.assert_called_with(
+            "https://api.electricitymap.org/v3/carbon-intensity/latest",
+            params={"zone": country_code},
+            timeout=(
+                settings.ELECTRICITY_MAP_CONNECT_TIMEOUT,
+                settings.ELECTRICITY_MAP_READ_TIMEOUT,
+            ),
         )
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_fetch_carbon_data_empty_response(self, mock_get):
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -79,8 +171,330 @@ class RealtimeCarbonDataTestCase(TestCase):
         self.assertEqual(RealtimeEnvironmentalRecord.objects.count(), 0)
 
 
+class ElectricityMapClientTestCase(TestCase):
+    def test_session_is_reused_with_auth_and_pool_size(self):
+        session = electricitymap.get_session()
+
+        self.assertIs(electricitymap.get_session(), session)
+        self.assertEqual(
+            session.headers["Authorization"],
+            f"Bearer {settings.ELECTRICITY_MAP_API_KEY}",
+        )
+        adapter = session.get_adapter(electricitymap.API_URL)
+        self.assertEqual(adapter._pool_maxsize, settings.ELECTRICITY_MAP_POOL_SIZE)
+
+
+def api_response(status_code, data=None):
+    response = MagicMock(status_code=status_code)
+    response.json.return_value = data or {}
+    return response
+
+
+@patch("environmental_data.electricitymap.time.sleep")
+class UpstreamProtectionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch("requests.Session.get")
+    def test_failures_are_retried_with_backoff(self, mock_get, sleep):
+        mock_get.side_effect = [
+            api_response(502),
+            requests.Timeout("read timed out"),
+            api_response(200, {"carbonIntensity": 100}),
+        ]
+
+        status, data = electricitymap.get_json("carbon-intensity/latest")
+
+        self.assertEqual((status, data), (200, {"carbonIntensity": 100}))
+        self.assertEqual(len(sleep.call_args_list), 2)
+        self.assertLess(sleep.call_args_list[0][0][0], sleep.call_args_list[1][0][0])
+
+    @override_settings(
+        ELECTRICITY_MAP_RETRY_BUDGET=0, ELECTRICITY_MAP_RETRY_BUDGET_MIN=1
+    )
+    @patch("requests.Session.get")
+    def test_retry_budget_limits_retries(self, mock_get, sleep):
+        mock_get.return_value = api_response(500)
+
+        electricitymap.get_json("carbon-intensity/latest", {"zone": "DE"})
+        electricitymap.get_json("carbon-intensity/latest", {"zone": "FR"})
+
+        self.assertEqual(mock_get.call_count, 3)
+        self.assertEqual(electricitymap.upstream_metrics()["retry_budget"]["calls"], 2)
+
+    @override_settings(
+        ELECTRICITY_MAP_MAX_RETRIES=0, ELECTRICITY_MAP_BREAKER_THRESHOLD=2
+    )
+    @patch("requests.Session.get")
+    def test_breaker_fails_fast_until_probe_succeeds(self, mock_get, sleep):
+        mock_get.return_value = api_response(503)
+        for zone in ("DE", "FR"):
+            electricitymap.get_json("carbon-intensity/latest", {"zone": zone})
+
+        with self.assertRaises(electricitymap.CircuitOpenError):
+            electricitymap.get_json("carbon-intensity/latest", {"zone": "PL"})
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(electricitymap.upstream_metrics()["state"], resilience.OPEN)
+        self.assertEqual(electricitymap.upstream_metrics()["short_circuited"], 1)
+
+        cache.delete(electricitymap.breaker().key("open"))  # Cooldown is over.
+        mock_get.return_value = api_response(200, {"carbonIntensity": 100})
+        status, _ = electricitymap.get_json("carbon-intensity/latest", {"zone": "PL"})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(electricitymap.upstream_metrics()["state"], resilience.CLOSED)
+
+
+class FetchRealtimeEmissionsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    # FR and GB fail with retries; the breaker must not trip and
+    # short-circuit DE and PL depending on thread scheduling.
+    @override_settings(ELECTRICITY_MAP_BREAKER_THRESHOLD=100)
+    @patch("environmental_data.electricitymap.time.sleep")
+    @patch("requests.Session.get")
+    def test_fetch_many_zones(self, mock_get, sleep):
+        def respond(url, params, **kwargs):
+            zone = params["zone"]
+            if zone == "GB":
+                raise requests.ConnectionError("connection refused")
+            response = MagicMock()
+            response.status_code = 500 if zone == "FR" else 200
+            response.json.return_value = {"carbonIntensity": 100, "zone": zone}
+            return response
+
+        mock_get.side_effect = respond
+
+        statuses = fetch_realtime_emissions(["DE", "PL", "FR", "GB"], max_concurrency=2)
+
+        self.assertEqual(statuses["DE"], "ok")
+        self.assertEqual(statuses["PL"], "ok")
+        self.assertEqual(statuses["FR"], "failed: 500")
+        self.assertTrue(statuses["GB"].startswith("error:"))
+        self.assertEqual(
+            set(
+                RealtimeEnvironmentalRecord.objects.values_list(
+                    "country__code", flat=True
+                )
+            ),
+            {"DE", "PL"},
+        )
+
+    @override_settings(REALTIME_ZONES=[])
+    @patch("requests.Session.get")
+    def test_fetch_no_zones(self, mock_get):
+        self.assertEqual(fetch_realtime_emissions(), {})
+        mock_get.assert_not_called()
+
+
+@override_settings(
+    REALTIME_WRITE_BEHIND=True,
+    REALTIME_BUFFER={"BACKEND": "environmental_data.buffer.MemoryBuffer"},
+)
+class WriteBehindTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        buffer._buffers.clear()
+
+    def poll(self, mock_get, zones, when="2024-11-15T12:00:00Z"):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "carbonIntensity": 100,
+            "datetime": when,
+        }
+        cache.clear()
+        return fetch_realtime_emissions(zones)
+
+    @patch("requests.Session.get")
+    def test_polls_are_buffered_and_flushed_in_batches(self, mock_get):
+        statuses = self.poll(mock_get, ["DE", "FR"])
+        self.poll(mock_get, ["DE"], when="2024-11-15T13:00:00Z")
+
+        self.assertEqual(statuses, {"DE": "buffered", "FR": "buffered"})
+        self.assertFalse(RealtimeEnvironmentalRecord.objects.exists())
+        self.assertEqual(buffer.get_buffer().depth(), 3)
+
+        with override_settings(REALTIME_BUFFER_BATCH_SIZE=2):
+            metrics = flush_realtime_buffer()
+
+        self.assertEqual(metrics["flushed"], 3)
+        self.assertEqual(metrics["inserted"], 3)
+        self.assertEqual(metrics["depth"], 0)
+        self.assertEqual(RealtimeEnvironmentalRecord.objects.count(), 3)
+        self.assertEqual(buffer.buffer_metrics()["last_flush"], metrics)
+
+    @patch("requests.Session.get")
+    def test_failed_flush_is_delivered_again(self, mock_get):
+        self.poll(mock_get, ["DE"])
+        self.poll(mock_get, ["DE"])
+
+        with patch(
+            "environmental_data.tasks.insert_readings", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                flush_realtime_buffer()
+        self.assertEqual(buffer.get_buffer().depth(), 2)
+
+        metrics = flush_realtime_buffer()
+
+        self.assertEqual(metrics["flushed"], 2)
+        self.assertEqual(metrics["inserted"], 1)
+        self.assertEqual(RealtimeEnvironmentalRecord.objects.count(), 1)
+
+
+@patch("environmental_data.scheduler.random.uniform", return_value=0)
+class SchedulerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = datetime(2024, 11, 15, 12, 5, tzinfo=tz.utc)
+
+    def test_new_zone_learns_cadence_from_history(self, uniform):
+        country = Country.objects.create(code="DE", name="Germany")
+        substance = Substance.objects.create(name="CO2")
+        sector = Sector.objects.create(name="Total Emissions")
+        for minutes in (0, 15, 30, 45):
+            RealtimeEnvironmentalRecord.objects.create(
+                country=country,
+                substance=substance,
+                sector=sector,
+                value=100,
+                timestamp=self.now - timedelta(minutes=60 - minutes),
+            )
+
+        updated_at = self.now - timedelta(minutes=5)
+        record_polls(["DE"], {"DE": {"updatedAt": updated_at.isoformat()}}, self.now)
+
+        state = ZonePollState.objects.get(zone="DE")
+        self.assertEqual(state.interval, 900)
+        self.assertEqual(
+            state.next_poll_at,
+            updated_at + timedelta(seconds=900 + settings.REALTIME_POLL_DELAY),
+        )
+
+    def test_quiet_zone_backs_off(self, uniform):
+        reading = {"FR": {"updatedAt": "2024-11-15T10:00:00Z"}}
+        backoffs = []
+        for _ in range(8):
+            record_polls(["FR"], reading, self.now)
+            state = ZonePollState.objects.get(zone="FR")
+            backoffs.append((state.next_poll_at - self.now).total_seconds())
+
+        self.assertEqual(state.quiet_polls, 7)
+        self.assertEqual(backoffs[:3], [300, 600, 1200])
+        self.assertEqual(backoffs[-1], settings.REALTIME_POLL_MAX_INTERVAL)
+
+    @patch("requests.Session.get")
+    def test_only_due_zones_are_polled(self, mock_get, uniform):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "carbonIntensity": 100,
+            "datetime": "2024-11-15T12:00:00Z",
+        }
+        ZonePollState.objects.create(
+            zone="FR",
+            interval=3600,
+            next_poll_at=timezone.now() + timedelta(hours=1),
+        )
+
+        statuses = poll_due_zones(["DE", "FR"])
+
+        self.assertEqual(statuses, {"DE": "ok"})
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertGreater(
+            ZonePollState.objects.get(zone="DE").next_poll_at, timezone.now()
+        )
+
+
+class RealtimeSeriesTests(TestCase):
+    def setUp(self):
+        dimensions.clear_all()
+        self.germany = Country.objects.create(name="Germany", code="DE")
+        self.start = datetime(2024, 1, 1, tzinfo=tz.utc)
+        values = np.sin(np.arange(2000) / 50.0)
+        values[1234] = 10.0
+        co2 = Substance.objects.create(name="CO2")
+        total = Sector.objects.create(name="Total Emissions")
+        RealtimeEnvironmentalRecord.objects.bulk_create(
+            RealtimeEnvironmentalRecord(
+                country=self.germany,
+                substance=co2,
+                sector=total,
+                timestamp=self.start + timedelta(minutes=minute),
+                value=float(value),
+            )
+            for minute, value in enumerate(values)
+        )
+
+    def get(self, **params):
+        return RealtimeSeriesView.as_view()(APIRequestFactory().get("/", params))
+
+    def test_downsampling_keeps_endpoints_and_peaks(self):
+        x = np.arange(10000, dtype=float)
+        y = np.random.default_rng(0).normal(size=10000)
+        y[4321] = 50.0
+
+        for indices in (lttb(x, y, 500), minmax(y, 500)):
+            self.assertLessEqual(len(indices), 500)
+            self.assertEqual(indices[0], 0)
+            self.assertEqual(indices[-1], 9999)
+            self.assertTrue(np.all(np.diff(indices) > 0))
+            self.assertIn(4321, indices)
+        self.assertEqual(len(lttb(x, y, 500)), 500)
+        self.assertEqual(lttb(x[:10], y[:10], 500).tolist(), list(range(10)))
+
+    def test_series_is_downsampled(self):
+        for method in ("lttb", "minmax"):
+            with self.assertNumQueries(2):
+                response = self.get(
+                    zone="DE",
+                    start=self.start.isoformat(),
+                    end=(self.start + timedelta(days=2)).isoformat(),
+                    points=100,
+                    method=method,
+                )
+            data = json.loads(response.content)
+            self.assertEqual(data["source_points"], 2000)
+            self.assertLessEqual(len(data["series"]), 100)
+            self.assertEqual(data["series"][0], [self.start.isoformat(), 0.0])
+            self.assertIn(10.0, [value for _, value in data["series"]])
+
+    def test_series_defaults_to_recent_readings(self):
+        with patch(
+            "environmental_data.views.timezone.now",
+            return_value=self.start + timedelta(minutes=99),
+        ):
+            data = json.loads(self.get(zone="DE", start="2024-01-01T01:00").content)
+        self.assertEqual(data["source_points"], 40)
+        self.assertEqual(len(data["series"]), 40)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.get().status_code, 400)
+        self.assertEqual(self.get(zone="DE", start="yesterday").status_code, 400)
+        self.assertEqual(self.get(zone="DE", points=2).status_code, 400)
+        self.assertEqual(self.get(zone="DE", method="mean").status_code, 400)
+        self.assertEqual(self.get(zone="XX").status_code, 404)
+
+    def test_dashboard_filters_by_country(self):
+        request = APIRequestFactory().get("/")
+        with patch("environmental_data.views.render") as render:
+            realtime_emissions_dashboard(request, country_code="DE")
+        context = render.call_args.args[2]
+        self.assertEqual(context["region"], self.germany)
+        self.assertEqual(len(context["emissions_data"]), 24)
+        self.assertEqual(
+            context["emissions_data"][0].timestamp,
+            self.start + timedelta(minutes=1999),
+        )
+
+
 class TestFetchRecentCarbonlData(TestCase):
-    @patch("requests.get")
+    def setUp(self):
+        cache.clear()
+        dimensions.clear_all()
+        self.addCleanup(dimensions.clear_all)
+
+    @patch("requests.Session.get")
     def test_fetch_recent_carbon_data_success(self, mock_get):
         mock_response_data = {
             "data": [
@@ -124,8 +538,54 @@ class TestFetchRecentCarbonlData(TestCase):
 
         self.assertEqual(records.count(), 2)
 
-    @patch("requests.get")
-    def test_fetch_recent_carbon_data_api_failure(self, mock_get):
+    @patch("requests.Session.get")
+    def test_fetch_recent_carbon_data_skips_stored_points(self, mock_get):
+        stored = timezone.now().replace(microsecond=0) - timedelta(hours=1)
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "data": [
+                {"timestamp": stored.timestamp(), "carbonIntensity": 200},
+                {"timestamp": None, "carbonIntensity": 190},
+                {"timestamp": timezone.now().timestamp(), "carbonIntensity": 180},
+            ],
+            "zoneName": "Germany",
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            fetch_recent_carbon_data("DE", time_range_hours=2)
+        RealtimeEnvironmentalRecord.objects.filter(value=180).delete()
+
+        # Dimensions come from the cache: one read and one batched insert.
+        with self.assertNumQueries(2):
+            result = fetch_recent_carbon_data("DE", time_range_hours=2)
+
+        self.assertEqual(result, {"inserted": 1, "skipped": 2})
+        self.assertEqual(RealtimeEnvironmentalRecord.objects.count(), 2)
+
+    def test_dimension_cache_is_invalidated_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            country_id = dimensions.countries.get("DE", defaults={"name": "Germany"})
+        with self.assertNumQueries(0):
+            self.assertEqual(dimensions.countries.get("DE"), country_id)
+
+        Country.objects.filter(pk=country_id).get().delete()
+        with self.assertNumQueries(3):
+            self.assertNotEqual(dimensions.countries.get("DE"), country_id)
+
+    def test_dimension_cache_follows_changes_in_other_processes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            country_id = dimensions.countries.get("DE", defaults={"name": "Germany"})
+            dimensions.substances.get("CO2")
+        with self.assertNumQueries(0):
+            self.assertEqual(dimensions.countries.get("DE"), country_id)
+
+        # Deleted by another process: no signal here, only the version moves.
+        Country.objects.filter(pk=country_id)._raw_delete("default")
+        cache.incr(catalog.VERSION_KEY)
+        self.assertIsNone(dimensions.countries.get("DE", create=False))
+
+    @patch("environmental_data.electricitymap.time.sleep")
+    @patch("requests.Session.get")
+    def test_fetch_recent_carbon_data_api_failure(self, mock_get, sleep):
         mock_get.return_value.status_code = 500  # Internal Server Error
 
         country_code = "DE"
@@ -136,7 +596,7 @@ class TestFetchRecentCarbonlData(TestCase):
         )
         self.assertEqual(records.count(), 0)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_fetch_recent_carbon_data_empty_response(self, mock_get):
         mock_get.return_value.status_code = 200
         mock_get.return_value.json.return_value = {"data": [], "zoneName": "Germany"}
@@ -150,6 +610,62 @@ class TestFetchRecentCarbonlData(TestCase):
         self.assertEqual(records.count(), 0)
 
 
+class BackfillTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start = datetime(2024, 1, 1, tzinfo=tz.utc)
+        self.end = datetime(2024, 1, 2, tzinfo=tz.utc)
+
+    def test_plan_splits_range_and_resumes(self):
+        windows = plan_backfill(["DE", "FR"], self.start, self.end, window_hours=10)
+
+        self.assertEqual(len(windows), 6)
+        self.assertEqual(windows[-1].end, self.end)
+
+        BackfillWindow.objects.filter(zone="DE").update(status=BackfillWindow.DONE)
+        windows = plan_backfill(["DE", "FR"], self.start, self.end, window_hours=10)
+
+        self.assertEqual({window.zone for window in windows}, {"FR"})
+        self.assertEqual(BackfillWindow.objects.count(), 6)
+
+    @override_settings(BACKFILL_RATE_PER_SECOND=1, BACKFILL_BURST=5)
+    @patch("requests.Session.get")
+    def test_window_is_checkpointed(self, mock_get):
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.json.return_value = {
+            "data": [{"timestamp": self.start.timestamp(), "carbonIntensity": 120}],
+            "zoneName": "Germany",
+        }
+        (window,) = plan_backfill(["DE"], self.start, self.end)
+
+        result = backfill_carbon_window(window.pk)
+        backfill_carbon_window(window.pk)
+
+        window.refresh_from_db()
+        self.assertEqual(result, {"inserted": 1, "skipped": 0})
+        self.assertEqual(window.status, BackfillWindow.DONE)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @override_settings(BACKFILL_MAX_ATTEMPTS=3)
+    @patch("environmental_data.electricitymap.time.sleep")
+    @patch("requests.Session.get")
+    def test_failed_window_is_retried(self, mock_get, sleep):
+        mock_get.return_value.status_code = 503
+        (window,) = plan_backfill(["DE"], self.start, self.end)
+
+        with self.assertRaises(Retry):
+            backfill_carbon_window(window.pk)
+
+        window.refresh_from_db()
+        self.assertEqual(window.status, BackfillWindow.FAILED)
+        self.assertEqual(window.error, "HTTP 503")
+
+    def test_token_bucket_limits_bursts(self):
+        self.assertEqual(take_token("test", rate=0.5, capacity=2), 0)
+        self.assertEqual(take_token("test", rate=0.5, capacity=2), 0)
+        self.assertGreater(take_token("test", rate=0.5, capacity=2), 1)
+
+
 class FilterTests(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -184,6 +700,514 @@ class FilterTests(TestCase):
             year=2020,
         )
 
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(dimensions.clear_all)
+
+    def test_snapshot_matches_database(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        factory = APIRequestFactory()
+        queries = [
+            {},
+            {"country": "Germany"},
+            {"country": "Germany,France", "sector": "Energy"},
+            {"country": "Germany", "start_year": 2021, "end_year": 2021},
+        ]
+
+        with override_settings(HISTORICAL_SNAPSHOT_DIR=tmp_dir.name):
+            expected = {
+                (view, index): view.as_view()(factory.get("/", query)).data
+                for view in (CountryTotalDataView, FilteredEnvironmentalDataView)
+                for index, query in enumerate(queries)
+            }
+            cache.clear()
+            export_snapshot()
+            self.assertIsNotNone(load_snapshot())
+
+            for (view, index), data in expected.items():
+                response = view.as_view()(factory.get("/", queries[index]))
+                self.assertEqual(response.data, data)
+
+            response = CountryTotalDataView.as_view()(
+                factory.get("/", {"country": "Spain"})
+            )
+            self.assertEqual(response.status_code, 404)
+
+    def test_substance_filter(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        ch4 = Substance.objects.create(name="CH4")
+        HistoricalEnvironmentalRecord.objects.create(
+            country=self.germany,
+            sector=self.energy,
+            substance=ch4,
+            value=5.0,
+            year=2020,
+        )
+        factory = APIRequestFactory()
+        query = {"country": "Germany", "start_year": 2020, "end_year": 2020}
+        expected = {
+            "co2": (
+                {"Germany": {"Energy": {2020: 229639.50}}},
+                {"Germany": {"Total": {2020: 229639.50}}},
+            ),
+            "CH4": (
+                {"Germany": {"Energy": {2020: 5.0}}},
+                {"Germany": {"Total": {2020: 5.0}}},
+            ),
+        }
+
+        for snapshot in (False, True):
+            with override_settings(HISTORICAL_SNAPSHOT_DIR=tmp_dir.name):
+                cache.clear()
+                if snapshot:
+                    export_snapshot()
+                    self.assertIsNotNone(load_snapshot())
+                for substance, (records, totals) in expected.items():
+                    params = {**query, "substance": substance}
+                    for view, data in (
+                        (FilteredEnvironmentalDataView, records),
+                        (CountryTotalDataView, totals),
+                    ):
+                        cache.clear()
+                        if snapshot:
+                            export_snapshot()
+                        response = view.as_view()(factory.get("/", params))
+                        self.assertEqual(response.data, data)
+                    response = CountryTotalDataView.as_view()(
+                        factory.get("/", {**params, "sector": "Energy"})
+                    )
+                    self.assertEqual(response.data, totals)
+
+                response = FilteredEnvironmentalDataView.as_view()(
+                    factory.get("/", {**query, "substance": "N2O"})
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_substance_is_part_of_the_cache_key(self):
+        ch4 = Substance.objects.create(name="CH4")
+        HistoricalEnvironmentalRecord.objects.create(
+            country=self.germany,
+            sector=self.energy,
+            substance=ch4,
+            value=5.0,
+            year=2020,
+        )
+        factory = APIRequestFactory()
+        query = {"country": "Germany", "start_year": 2020, "end_year": 2020}
+
+        values = [
+            FilteredEnvironmentalDataView.as_view()(
+                factory.get("/", {**query, "substance": substance})
+            ).data["Germany"]["Energy"][2020]
+            for substance in ("CO2", "CH4", "ch4")
+        ]
+        self.assertEqual(values, [229639.50, 5.0, 5.0])
+
+        etags = [
+            FilteredEnvironmentalDataView.as_view()(
+                factory.get("/", {**query, "substance": substance})
+            )["ETag"]
+            for substance in ("CH4", "ch4", "CO2")
+        ]
+        self.assertEqual(etags[0], etags[1])
+        self.assertNotEqual(etags[0], etags[2])
+
+    def test_snapshot_is_ignored_after_record_changes(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        factory = APIRequestFactory()
+        query = {"country": "France", "sector": "Energy"}
+
+        with override_settings(HISTORICAL_SNAPSHOT_DIR=tmp_dir.name):
+            export_snapshot()
+            self.assertIsNotNone(load_snapshot())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                HistoricalEnvironmentalRecord.objects.filter(
+                    country=self.france
+                ).get().delete()
+                HistoricalEnvironmentalRecord.objects.create(
+                    country=self.france,
+                    sector=self.energy,
+                    substance=self.co2,
+                    value=999.0,
+                    year=2020,
+                )
+
+            self.assertIsNone(load_snapshot())
+            for view, expected in (
+                (FilteredEnvironmentalDataView, {"Energy": {2020: 999.0}}),
+                (CountryTotalDataView, {"Total": {2020: 999.0}}),
+            ):
+                response = view.as_view()(factory.get("/", query))
+                self.assertEqual(response.data["France"], expected)
+
+    def test_snapshot_survives_new_dimensions(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+
+        with override_settings(HISTORICAL_SNAPSHOT_DIR=tmp_dir.name):
+            export_snapshot()
+            with self.captureOnCommitCallbacks(execute=True):
+                dimensions.countries.get("ZZ", defaults={"name": "Zone"})
+            self.assertIsNotNone(load_snapshot())
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.energy.name = "Power"
+                self.energy.save()
+            self.assertIsNone(load_snapshot())
+
+    def test_snapshot_export_rejects_dangling_ids(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        with connection.constraint_checks_disabled():
+            HistoricalEnvironmentalRecord.objects.filter(country=self.france).update(
+                substance_id=self.co2.id + 100
+            )
+        with self.assertRaisesMessage(ValueError, "substance ids missing"):
+            export_snapshot(tmp_dir.name)
+        HistoricalEnvironmentalRecord.objects.filter(country=self.france).update(
+            substance_id=self.co2.id
+        )
+
+    def test_database_path_queries(self):
+        factory = APIRequestFactory()
+        # The records view first looks up the most recent year.
+        for view, queries, countries in (
+            (CountryTotalDataView, 1, {"Germany", "France"}),
+            (FilteredEnvironmentalDataView, 2, {"Germany"}),
+        ):
+            with self.assertNumQueries(queries):
+                response = view.as_view()(factory.get("/"))
+            self.assertEqual(set(response.data), countries)
+
+    def test_most_recent_year_comes_from_coverage(self):
+        factory = APIRequestFactory()
+        view = FilteredEnvironmentalDataView.as_view()
+
+        # One lookup in the coverage index, then only the rows of that year.
+        with self.assertNumQueries(2):
+            response = view(factory.get("/"))
+        self.assertEqual(response.data, {"Germany": {"Transport": {2021: 144180.14}}})
+
+        response = view(factory.get("/", {"country": "France"}))
+        self.assertEqual(response.data, {"France": {"Energy": {2020: 38285.24}}})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HistoricalEnvironmentalRecord.objects.filter(year=2021).get().delete()
+        response = view(factory.get("/"))
+        self.assertEqual(
+            response.data,
+            {
+                "Germany": {"Energy": {2020: 229639.50}},
+                "France": {"Energy": {2020: 38285.24}},
+            },
+        )
+
+        # An unknown sector is resolved without reading the coverage index.
+        with self.assertNumQueries(1):
+            response = view(factory.get("/", {"sector": "Waste"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_uncovered_filters_do_not_read_records(self):
+        factory = APIRequestFactory()
+        queries = [
+            {"country": "Germany", "start_year": 1990, "end_year": 1999},
+            {"country": "France", "sector": "Transport"},
+            {"country": "Atlantis"},
+        ]
+        for view in (CountryTotalDataView, FilteredEnvironmentalDataView):
+            for query in queries:
+                with CaptureQueriesContext(connection) as queries_run:
+                    response = view.as_view()(factory.get("/", query))
+                self.assertEqual(response.status_code, 404)
+                self.assertFalse(
+                    any(
+                        "historicalenvironmentalrecord" in query["sql"]
+                        or "countryyeartotal" in query["sql"]
+                        for query in queries_run.captured_queries
+                    )
+                )
+
+    def test_catalog_is_served_from_encoded_bytes(self):
+        factory = APIRequestFactory()
+        with self.assertNumQueries(3):
+            response = CatalogView.as_view()(
+                factory.get("/", HTTP_ACCEPT_ENCODING="gzip, br")
+            )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        gzip_etag = response["ETag"]
+        catalog = json.loads(gzip.decompress(response.content))
+        self.assertEqual(
+            catalog["countries"],
+            [
+                {"id": self.france.id, "name": "France", "code": "FR"},
+                {"id": self.germany.id, "name": "Germany", "code": "DE"},
+            ],
+        )
+        self.assertEqual(catalog["substances"], [{"id": self.co2.id, "name": "CO2"}])
+
+        with self.assertNumQueries(0):
+            response = CatalogView.as_view()(factory.get("/"))
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(json.loads(response.content), catalog)
+
+        self.assertNotEqual(response["ETag"], gzip_etag)
+
+        response = CatalogView.as_view()(
+            factory.get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        )
+        self.assertEqual(response.status_code, 304)
+        # The gzip ETag does not validate the identity body.
+        response = CatalogView.as_view()(factory.get("/", HTTP_IF_NONE_MATCH=gzip_etag))
+        self.assertEqual(response.status_code, 200)
+        response = CatalogView.as_view()(
+            factory.get("/", HTTP_IF_NONE_MATCH=gzip_etag, HTTP_ACCEPT_ENCODING="gzip")
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_views_are_rebuilt_when_dimensions_change(self):
+        factory = APIRequestFactory()
+        response = SectorListView.as_view()(factory.get("/"))
+        self.assertEqual(
+            json.loads(response.content), [{"name": "Energy"}, {"name": "Transport"}]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.transport.name = "Aviation"
+            self.transport.save()
+        with self.assertNumQueries(1):
+            response = SectorListView.as_view()(factory.get("/"))
+        self.assertEqual(
+            json.loads(response.content), [{"name": "Aviation"}, {"name": "Energy"}]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            dimensions.substances.get("CH4")
+        response = SubstanceListView.as_view()(factory.get("/"))
+        self.assertEqual(
+            json.loads(response.content), [{"name": "CH4"}, {"name": "CO2"}]
+        )
+
+    def test_coverage_endpoint(self):
+        response = HistoricalCoverageView.as_view()(APIRequestFactory().get("/"))
+        self.assertEqual(
+            json.loads(response.content),
+            [
+                {
+                    "country": "France",
+                    "country_code": "FR",
+                    "sector": "Energy",
+                    "substance": "CO2",
+                    "first_year": 2020,
+                    "last_year": 2020,
+                    "rows": 1,
+                },
+                {
+                    "country": "Germany",
+                    "country_code": "DE",
+                    "sector": "Energy",
+                    "substance": "CO2",
+                    "first_year": 2020,
+                    "last_year": 2020,
+                    "rows": 1,
+                },
+                {
+                    "country": "Germany",
+                    "country_code": "DE",
+                    "sector": "Transport",
+                    "substance": "CO2",
+                    "first_year": 2021,
+                    "last_year": 2021,
+                    "rows": 1,
+                },
+            ],
+        )
+
+    def test_totals_are_read_from_rollup(self):
+        HistoricalEnvironmentalRecord.objects.get(
+            country=self.germany, sector=self.transport, year=2021
+        ).delete()
+        expected = {
+            (country, year): total
+            for country, year, total in HistoricalEnvironmentalRecord.objects.order_by()
+            .values_list("country__name", "year")
+            .annotate(total=Sum("value"))
+        }
+
+        with self.assertNumQueries(1):
+            response = CountryTotalDataView.as_view()(APIRequestFactory().get("/"))
+
+        self.assertEqual(
+            {
+                (country, year): total
+                for country, totals in response.data.items()
+                for year, total in totals["Total"].items()
+            },
+            expected,
+        )
+
+    def test_responses_are_cached_per_generation(self):
+        factory = APIRequestFactory()
+        view = FilteredEnvironmentalDataView.as_view()
+        years = {"start_year": 2020, "end_year": 2021}
+        first = view(factory.get("/", {"country": "Germany,France", **years}))
+
+        with self.assertNumQueries(0):
+            second = view(
+                factory.get("/", {"country": "France,Germany,France", **years})
+            )
+        self.assertEqual(second.data, first.data)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            HistoricalEnvironmentalRecord.objects.filter(country=self.france).update(
+                value=1.0
+            )
+            bump_generation()
+        third = view(factory.get("/", {"country": "Germany,France", **years}))
+        self.assertEqual(third.data["France"]["Energy"][2020], 1.0)
+
+    def test_process_local_response_cache_fails_check(self):
+        with override_settings(DEBUG=False):
+            self.assertEqual(
+                [error.id for error in check_response_cache(None)],
+                ["environmental_data.E001"],
+            )
+        with override_settings(DEBUG=True):
+            self.assertEqual(
+                [error.id for error in check_response_cache(None)],
+                ["environmental_data.W001"],
+            )
+        redis = {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": "redis://localhost:6379/1",
+        }
+        with override_settings(CACHES={"default": redis}):
+            self.assertEqual(check_response_cache(None), [])
+
+    def test_export_streams_all_years(self):
+        response = HistoricalExportView.as_view()(APIRequestFactory().get("/"))
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).splitlines()
+        ]
+        self.assertEqual(len(rows), HistoricalEnvironmentalRecord.objects.count())
+        self.assertEqual({row["year"] for row in rows}, {2020, 2021})
+
+    def test_export_csv_with_filters(self):
+        view = HistoricalExportView.as_view()
+        factory = APIRequestFactory()
+        response = view(
+            factory.get("/", {"format": "csv", "country": "DE", "sector": "energy"})
+        )
+
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        rows = list(csv.DictReader(lines))
+        self.assertEqual(lines[0], "country_code,country,sector,substance,year,value")
+        self.assertEqual({row["sector"] for row in rows}, {"Energy"})
+        self.assertEqual({row["country"] for row in rows}, {"Germany"})
+        self.assertEqual([row["year"] for row in rows], ["2020"])
+
+        response = view(factory.get("/", {"format": "xml"}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_keyset_pages_cover_all_records(self):
+        # Records of another substance share every key but are not paged.
+        ch4 = Substance.objects.create(name="CH4")
+        for record in HistoricalEnvironmentalRecord.objects.all():
+            record.pk, record.substance = None, ch4
+            record.save()
+        factory = APIRequestFactory()
+        view = FilteredEnvironmentalDataView.as_view()
+
+        for substance in ("CO2", "ch4"):
+            seen = []
+            params = {"page_size": 1, "substance": substance}
+            while True:
+                response = view(factory.get("/", params))
+                self.assertEqual(response.status_code, 200)
+                page = [
+                    (year, country, sector)
+                    for country, sectors in response.data["results"].items()
+                    for sector, values in sectors.items()
+                    for year in values
+                ]
+                self.assertEqual(len(page), 1)
+                seen.extend(page)
+                if response.data["next"] is None:
+                    break
+                params = {**params, "cursor": response.data["next"]}
+
+            self.assertEqual(len(seen), 3)
+            self.assertEqual(seen[0][0], 2021)
+
+    @override_settings(HISTORICAL_PAGE_SIZE_MAX=2)
+    def test_page_size_is_capped_and_cursor_validated(self):
+        factory = APIRequestFactory()
+        view = FilteredEnvironmentalDataView.as_view()
+
+        response = view(factory.get("/", {"page_size": 1000}))
+        self.assertEqual(
+            sum(
+                len(values)
+                for sectors in response.data["results"].values()
+                for values in sectors.values()
+            ),
+            2,
+        )
+        self.assertIsNotNone(response.data["next"])
+
+        response = view(factory.get("/", {"cursor": "not-a-cursor"}))
+        self.assertEqual(response.status_code, 400)
+
+        # Unpaginated responses over the cap get the first page instead.
+        years = {"start_year": 2020, "end_year": 2021}
+        response = view(factory.get("/", years))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data["results"],
+            {"Germany": {"Transport": {2021: 144180.14}, "Energy": {2020: 229639.50}}},
+        )
+        response = view(factory.get("/", {**years, "cursor": response.data["next"]}))
+        self.assertEqual(
+            response.data,
+            {"results": {"France": {"Energy": {2020: 38285.24}}}, "next": None},
+        )
+        response = view(
+            factory.get(
+                "/", {"country": "Germany", "start_year": 2020, "end_year": 2021}
+            )
+        )
+        self.assertEqual(set(response.data["Germany"]), {"Energy", "Transport"})
+
+    def test_matching_etag_returns_not_modified(self):
+        factory = APIRequestFactory()
+        view = CountryTotalDataView.as_view()
+        response = view(factory.get("/", {"country": "Germany"}))
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        self.assertNotEqual(view(factory.get("/", {"country": "France"}))["ETag"], etag)
+
+        with self.assertNumQueries(0):
+            response = view(
+                factory.get("/", {"country": "Germany"}, HTTP_IF_NONE_MATCH=etag)
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_generation()
+        response = view(
+            factory.get("/", {"country": "Germany"}, HTTP_IF_NONE_MATCH=etag)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
     def test_filter_by_country(self):
         factory = APIRequestFactory()
         request = factory.get(
@@ -261,3 +1285,446 @@ class FilterTests(TestCase):
         data = response.data
         self.assertIn("France", data)
         self.assertEqual(len(data["France"]["Total"]), 1)
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.seed_dataset()
+
+    def test_views_stay_within_query_budget(self):
+        cases = [
+            (CountryListView, {}),
+            (SectorListView, {}),
+            (SubstanceListView, {}),
+            (CatalogView, {}),
+            (HistoricalCoverageView, {}),
+            (FilteredEnvironmentalDataView, {"substance": "Substance 0"}),
+            (
+                FilteredEnvironmentalDataView,
+                {"substance": "Substance 1", "start_year": 2000, "end_year": 2009},
+            ),
+            (
+                FilteredEnvironmentalDataView,
+                {
+                    "country": "Country 0,Country 1",
+                    "sector": "Sector 2",
+                    "substance": "Substance 0",
+                },
+            ),
+            (
+                FilteredEnvironmentalDataView,
+                {"substance": "Substance 1", "page_size": 7},
+            ),
+            (CountryTotalDataView, {}),
+            (CountryTotalDataView, {"country": "Country 3", "sector": "Sector 1"}),
+            (HistoricalExportView, {}),
+            (HistoricalExportView, {"format": "csv", "country": "C1"}),
+        ]
+        for view, params in cases:
+            with self.subTest(view=view.__name__, params=params):
+                self.assertWithinQueryBudget(view, params)
+
+    def test_budget_overrun_fails(self):
+        with patch.object(CountryListView, "query_budget", 0):
+            with self.assertRaises(AssertionError):
+                self.assertWithinQueryBudget(CountryListView)
+
+    def test_middleware_logs_queries_and_sets_header_when_enabled(self):
+        def get_response(request):
+            list(Country.objects.all())
+            return HttpResponse()
+
+        middleware = QueryStatsMiddleware(get_response)
+        request = APIRequestFactory().get("/environmental-data/api/countries/")
+
+        with self.assertLogs("environmental_data.instrumentation") as logs:
+            response = middleware(request)
+        self.assertIn(
+            "GET /environmental-data/api/countries/: 1 queries", logs.output[0]
+        )
+        self.assertNotIn("X-Query-Count", response)
+
+        with override_settings(QUERY_STATS_HEADER=True):
+            response = middleware(request)
+        self.assertEqual(response["X-Query-Count"], "1")
+        self.assertTrue(response["Server-Timing"].startswith("db;dur="))
+
+    def test_middleware_warns_over_budget(self):
+        middleware = QueryStatsMiddleware(
+            lambda request: HttpResponse(len(Country.objects.all()))
+        )
+        request = APIRequestFactory().get("/")
+
+        with patch.object(CountryListView, "query_budget", 0):
+            middleware.process_view(request, CountryListView.as_view(), (), {})
+            with self.assertLogs(
+                "environmental_data.instrumentation", "WARNING"
+            ) as logs:
+                middleware(request)
+        self.assertIn("over its budget of 0", logs.output[0])
+
+    def test_tasks_log_queries(self):
+        with self.assertLogs("environmental_data.instrumentation") as logs:
+            task_prerun.send(
+                sender=flush_realtime_buffer, task_id="t1", task=flush_realtime_buffer
+            )
+            Country.objects.count()
+            task_postrun.send(sender=flush_realtime_buffer, task_id="t1")
+        self.assertIn(
+            "task environmental_data.tasks.flush_realtime_buffer: 1 queries",
+            logs.output[0],
+        )
+
+
+class ImportEnvironmentalDataTests(TestCase):
+    def setUp(self):
+        dimensions.clear_all()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        snapshot_settings = override_settings(
+            HISTORICAL_SNAPSHOT_DIR=Path(self.tmp_dir.name) / "snapshot"
+        )
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+        self.csv_path = Path(self.tmp_dir.name) / "edgar.csv"
+        pd.DataFrame(
+            {
+                "continental region": ["Europe", "Europe", "Europe", "Europe"],
+                "country_code": ["DE", "DE", "FR", None],
+                "country_name": ["Germany", "Germany", "France", "Unknown"],
+                "sector": ["Energy", "Transport", "Energy", "Energy"],
+                "2020": [229639.50, 144180.14, 38285.24, 1.0],
+                "2021": [230000.00, None, 39000.00, 1.0],
+            }
+        ).to_csv(self.csv_path, index=False)
+
+    def test_import_melts_year_columns(self):
+        out = StringIO()
+        call_command(
+            "import_environmental_data",
+            str(self.csv_path),
+            workers=1,
+            chunk_size=2,
+            batch_size=2,
+            stdout=out,
+        )
+
+        self.assertEqual(HistoricalEnvironmentalRecord.objects.count(), 5)
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertEqual(Sector.objects.count(), 2)
+        record = HistoricalEnvironmentalRecord.objects.get(
+            country__code="DE", sector__name="Energy", year=2021
+        )
+        self.assertEqual(record.value, 230000.00)
+        self.assertEqual(record.substance.name, "CO2")
+        self.assertIn("rows/s", out.getvalue())
+        self.assertEqual(len(load_snapshot()), 5)
+
+    def test_reimport_unchanged_file_is_skipped(self):
+        call_command("import_environmental_data", str(self.csv_path), workers=1)
+        out = StringIO()
+        call_command(
+            "import_environmental_data", str(self.csv_path), workers=1, stdout=out
+        )
+
+        self.assertIn("unchanged, skipping", out.getvalue())
+        self.assertEqual(HistoricalEnvironmentalRecord.objects.count(), 5)
+
+    def test_reimport_changed_file_upserts_changed_rows(self):
+        call_command("import_environmental_data", str(self.csv_path), workers=1)
+        df = pd.read_csv(self.csv_path)
+        df.loc[0, "2020"] = 1.5
+        df.loc[1, "2021"] = 2.5
+        df.to_csv(self.csv_path, index=False)
+
+        out = StringIO()
+        call_command(
+            "import_environmental_data", str(self.csv_path), workers=1, stdout=out
+        )
+
+        self.assertIn("1 created, 1 updated, 4 unchanged", out.getvalue())
+        self.assertEqual(HistoricalEnvironmentalRecord.objects.count(), 6)
+        record = HistoricalEnvironmentalRecord.objects.get(
+            country__code="DE", sector__name="Energy", year=2020
+        )
+        self.assertEqual(record.value, 1.5)
+        self.assertEqual(
+            dict(
+                CountryYearTotal.objects.filter(country__code="DE").values_list(
+                    "year", "total"
+                )
+            ),
+            {2020: 1.5 + 144180.14, 2021: 230000.00 + 2.5},
+        )
+        self.assertEqual(
+            set(
+                HistoricalCoverage.objects.filter(country__code="DE").values_list(
+                    "sector__name", "first_year", "last_year", "rows"
+                )
+            ),
+            {("Energy", 2020, 2021, 2), ("Transport", 2020, 2021, 2)},
+        )
+
+    def test_duplicate_keys_are_summed(self):
+        pd.DataFrame(
+            {
+                "country_code": ["DE", "DE"],
+                "country_name": ["Germany", "Germany"],
+                "sector": ["Residential", "Residential"],
+                "2020": [100.0, 40.0],
+            }
+        ).to_csv(self.csv_path, index=False)
+
+        for chunk_size in (500, 1):
+            with self.subTest(chunk_size=chunk_size):
+                HistoricalEnvironmentalRecord.objects.all().delete()
+                out = StringIO()
+                call_command(
+                    "import_environmental_data",
+                    str(self.csv_path),
+                    workers=1,
+                    chunk_size=chunk_size,
+                    force=True,
+                    stdout=out,
+                )
+                self.assertIn("1 created, 0 updated, 0 unchanged", out.getvalue())
+                self.assertEqual(
+                    list(HistoricalEnvironmentalRecord.objects.values_list("value")),
+                    [(140.0,)],
+                )
+                self.assertEqual(
+                    CountryYearTotal.objects.get(country__code="DE", year=2020).total,
+                    140.0,
+                )
+
+                out = StringIO()
+                call_command(
+                    "import_environmental_data",
+                    str(self.csv_path),
+                    workers=1,
+                    force=True,
+                    stdout=out,
+                )
+                self.assertIn("0 created, 0 updated, 1 unchanged", out.getvalue())
+
+    def test_import_directory_infers_substance_per_file(self):
+        ch4_path = Path(self.tmp_dir.name) / "IEA_EDGAR_CH4_1970_2023.csv"
+        pd.DataFrame(
+            {
+                "country_code": ["DE", "NA"],
+                "country_name": ["Germany", "Namibia"],
+                "sector": ["Agriculture", "Agriculture"],
+                "2020": [10.0, 2.0],
+            }
+        ).to_csv(ch4_path, index=False)
+
+        call_command(
+            "import_environmental_data", self.tmp_dir.name, workers=1, stdout=StringIO()
+        )
+
+        self.assertEqual(
+            HistoricalEnvironmentalRecord.objects.filter(substance__name="CH4").count(),
+            2,
+        )
+        self.assertEqual(
+            HistoricalEnvironmentalRecord.objects.filter(substance__name="CO2").count(),
+            5,
+        )
+        self.assertTrue(Country.objects.filter(code="NA", name="Namibia").exists())
+
+    def test_import_raw_workbook(self):
+        xlsx_path = Path(self.tmp_dir.name) / "IEA_EDGAR_CO2_1970_2023.xlsx"
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.title = "IPCC 2006"
+        sheet.append(["Emissions by country and main source category"])
+        sheet.append(["Content:", "CO2 emissions"])
+        sheet.append([])
+        sheet.append(
+            [
+                "IPCC_annex",
+                "C_group_IM24_sh",
+                "Country_code_A3",
+                "Name",
+                "ipcc_code_2006_for_standard_report",
+                "ipcc_code_2006_for_standard_report_name",
+                "Substance",
+                "fossil_bio",
+                "Y_2020",
+                "Y_2021",
+            ]
+        )
+        sheet.append(
+            ["Annex_I", "Europe", "DEU", "Germany", "1.A.1", "Energy", "CO2", "fossil"]
+            + [229639.50, 230000.00]
+        )
+        sheet.append(
+            ["Int. Aviation", "Air", "AIR", "Int. Aviation", "1.C", "Air", "CO2"]
+            + ["fossil", 1.0, 2.0]
+        )
+        workbook.save(xlsx_path)
+
+        call_command(
+            "import_environmental_data",
+            str(xlsx_path),
+            workers=1,
+            chunk_size=1,
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(HistoricalEnvironmentalRecord.objects.count(), 2)
+        record = HistoricalEnvironmentalRecord.objects.get(
+            country__code="DE", sector__name="Energy", year=2021
+        )
+        self.assertEqual(record.value, 230000.00)
+
+
+class StaleDimensionTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        dimensions.clear_all()
+        self.addCleanup(dimensions.clear_all)
+
+    def test_insert_retries_after_stale_country_id(self):
+        country_id = dimensions.countries.get("ZZ", defaults={"name": "Zone"})
+        Country.objects.filter(pk=country_id)._raw_delete("default")
+        timestamp = timezone.now()
+
+        with self.assertLogs("environmental_data.tasks", "WARNING"):
+            statuses = insert_readings(
+                [
+                    {"zone": zone, "name": zone, "timestamp": timestamp, "value": 1.0}
+                    for zone in ("ZZ", "DE")
+                ]
+            )
+
+        self.assertEqual(set(statuses.values()), {"ok"})
+        self.assertEqual(
+            set(
+                RealtimeEnvironmentalRecord.objects.values_list(
+                    "country__code", flat=True
+                )
+            ),
+            {"ZZ", "DE"},
+        )
+
+
+class ParallelImportTests(TransactionTestCase):
+    """
+    Worker processes commit through their own connections, so these tests
+    run without a wrapping transaction.
+    """
+
+    def setUp(self):
+        cache.clear()
+        dimensions.clear_all()
+        self.addCleanup(dimensions.clear_all)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        snapshot_settings = override_settings(
+            HISTORICAL_SNAPSHOT_DIR=Path(self.tmp_dir.name) / "snapshot"
+        )
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+        for substance, values in (("CO2", [229639.50, 38285.24]), ("CH4", [10.0, 2.0])):
+            pd.DataFrame(
+                {
+                    "country_code": ["DE", "FR"],
+                    "country_name": ["Germany", "France"],
+                    "sector": ["Energy", "Agriculture"],
+                    "2020": values,
+                    "2021": [value * 2 for value in values],
+                }
+            ).to_csv(
+                Path(self.tmp_dir.name) / f"IEA_EDGAR_{substance}_1970_2023.csv",
+                index=False,
+            )
+
+    def import_with_workers(self, **options):
+        call_command(
+            "import_environmental_data",
+            self.tmp_dir.name,
+            workers=2,
+            stdout=StringIO(),
+            **options,
+        )
+
+        self.assertEqual(
+            dict(
+                HistoricalEnvironmentalRecord.objects.values_list("substance__name")
+                .annotate(rows=Count("id"))
+                .order_by()
+            ),
+            {"CO2": 4, "CH4": 4},
+        )
+        record = HistoricalEnvironmentalRecord.objects.get(
+            substance__name="CH4", country__code="FR", year=2021
+        )
+        self.assertEqual(record.value, 4.0)
+        self.assertEqual(Country.objects.count(), 2)
+        self.assertEqual(len(load_snapshot()), 8)
+
+    def test_import_two_substances_in_parallel(self):
+        self.import_with_workers()
+
+    def test_fast_import_two_substances_in_parallel(self):
+        table = HistoricalEnvironmentalRecord._meta.db_table
+        indexes = secondary_indexes(table)
+
+        self.import_with_workers(fast=True)
+
+        self.assertEqual(sorted(secondary_indexes(table)), sorted(indexes))
+        self.assertFalse(DroppedIndex.objects.exists())
+
+
+class FastImportTests(TransactionTestCase):
+    """
+    The bulk-load mode changes connection settings that SQLite refuses to
+    change inside a transaction, so these tests run without one.
+    """
+
+    def test_fast_import_restores_indexes(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        snapshot_settings = override_settings(
+            HISTORICAL_SNAPSHOT_DIR=Path(tmp_dir.name) / "snapshot"
+        )
+        snapshot_settings.enable()
+        self.addCleanup(snapshot_settings.disable)
+        csv_path = Path(tmp_dir.name) / "edgar.csv"
+        pd.DataFrame(
+            {
+                "country_code": ["DE", "FR"],
+                "country_name": ["Germany", "France"],
+                "sector": ["Energy", "Energy"],
+                "2020": [229639.50, 38285.24],
+                "2021": [230000.00, None],
+            }
+        ).to_csv(csv_path, index=False)
+        table = HistoricalEnvironmentalRecord._meta.db_table
+        indexes = secondary_indexes(table)
+        self.assertTrue(indexes)
+
+        call_command(
+            "import_environmental_data",
+            str(csv_path),
+            workers=1,
+            fast=True,
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(HistoricalEnvironmentalRecord.objects.count(), 3)
+        self.assertEqual(sorted(secondary_indexes(table)), sorted(indexes))
+        self.assertFalse(DroppedIndex.objects.exists())
+
+    def test_interrupted_fast_import_is_recovered(self):
+        table = HistoricalEnvironmentalRecord._meta.db_table
+        indexes = secondary_indexes(table)
+        drop_secondary_indexes([table])
+        self.assertEqual(secondary_indexes(table), [])
+
+        restored = restore_dropped_indexes()
+
+        self.assertEqual(sorted(restored), sorted(name for name, _ in indexes))
+        self.assertEqual(sorted(secondary_indexes(table)), sorted(indexes))
@@ -12,12 +12,34 @@ urlpatterns = [
         views.CountryTotalDataView.as_view(),
         name="country-totals",
     ),
+    path("api/catalog/", views.CatalogView.as_view(), name="catalog"),
     path("api/countries/", views.CountryListView.as_view(), name="country-list"),
     path("api/sectors/", views.SectorListView.as_view(), name="sector-list"),
     path("api/substances/", views.SubstanceListView.as_view(), name="substance-list"),
+    path(
+        "api/realtime-series/",
+        views.RealtimeSeriesView.as_view(),
+        name="realtime-series",
+    ),
+    path(
+        "api/realtime-buffer/",
+        views.realtime_buffer_metrics,
+        name="realtime-buffer-metrics",
+    ),
+    path("api/upstream-health/", views.upstream_health, name="upstream-health"),
     path(
         "api/historical-environmental-data/",
         views.FilteredEnvironmentalDataView.as_view(),
         name="historical-environmental-data",
     ),
+    path(
+        "api/historical-coverage/",
+        views.HistoricalCoverageView.as_view(),
+        name="historical-coverage",
+    ),
+    path(
+        "api/historical-environmental-data/export/",
+        views.HistoricalExportView.as_view(),
+        name="historical-environmental-data-export",
+    ),
 ]
@@ -1,63 +1,220 @@
+import csv
+import json
+from datetime import timedelta
+from datetime import timezone as dt_timezone
+from functools import cached_property
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Sum
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
 from django.views import View
 from rest_framework.response import Response
-from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from rest_framework.generics import ListAPIView
 from .filters import HistoricalDataFilter
 from environmental_data.serializer import HistoricalEnvironmentalRecordSerializer
 from rest_framework.exceptions import NotFound
+from . import dimensions
+from .catalog import catalog_response
+from .coverage import covering, is_covered, most_recent_year
+from .downsample import METHODS, downsample
+from .electricitymap import upstream_metrics
+from .buffer import buffer_metrics
+from .pagination import keyset_page, page_size
+from .response_cache import (
+    cached_response,
+    last_modified,
+    response_etag,
+)
+from .snapshot import load_snapshot
 
 from .models import (
+    CountryYearTotal,
+    HistoricalCoverage,
     HistoricalEnvironmentalRecord,
     RealtimeEnvironmentalRecord,
     Country,
-    Sector,
-    Substance,
 )
 
+ROW_CHUNK_SIZE = 10000
+EXPORT_COLUMNS = ["country_code", "country", "sector", "substance", "year", "value"]
+COVERAGE_FIELDS = [
+    "country",
+    "country_code",
+    "sector",
+    "substance",
+    "first_year",
+    "last_year",
+    "rows",
+]
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 
 def realtime_emissions_dashboard(
-    request: HttpRequest, region_code: str
+    request: HttpRequest, country_code: str
 ) -> HttpResponse:
     """
-    Displays a dashboard for the given region code with the last 24 hours of
-    emissions data.
+    Displays a dashboard for the given country code with the last 24
+    emissions readings.
 
-    Retrieves the region object for the given region code from the database.
-    Retrieves the last 24 hours of emissions data for the given region from the database.
-    Renders the emissions/dashboard.html template with the region and emissions data.
+    Retrieves the country object for the given country code from the database.
+    Retrieves its last 24 realtime emissions readings from the database.
+    Renders the emissions/dashboard.html template with the country and
+    emissions data.
 
     Args:
         request (HttpRequest): The request object
-        region_code (str): The region code (e.g. 'DE' for Germany)
+        country_code (str): The country code (e.g. 'DE' for Germany)
 
     Returns:
         HttpResponse: A rendered HTML template with the emissions data for the
-        given region
+        given country
     """
 
-    region = Country.objects.get(code=region_code)
+    country = Country.objects.get(code=country_code)
 
-    emissions_data = RealtimeEnvironmentalRecord.objects.filter(region=region).order_by(
-        "-timestamp"
-    )[:24]
+    emissions_data = RealtimeEnvironmentalRecord.objects.filter(
+        country=country
+    ).order_by("-timestamp")[:24]
 
     return render(
         request,
         "realtime_emissions/dashboard.html",
-        {"region": region, "emissions_data": emissions_data},
+        {"region": country, "emissions_data": emissions_data},
     )
 
 
+class RealtimeSeriesView(View):
+    """
+    Serve the realtime readings of a zone between ``start`` and ``end``
+    (ISO 8601, by default the last ``REALTIME_SERIES_DEFAULT_HOURS``)
+    downsampled to about ``points`` points for charting. ``method`` is
+    ``lttb`` (default) or ``minmax``.
+    """
+
+    query_budget = 2
+
+    def get(self, request, *args, **kwargs):
+        try:
+            zone, start, end, points, method = self.series_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({"error": str(error)}, status=400)
+
+        country_id = dimensions.countries.get(zone, create=False)
+        if country_id is None:
+            return JsonResponse({"error": f"Unknown zone {zone}."}, status=404)
+
+        rows = list(
+            RealtimeEnvironmentalRecord.objects.filter(
+                country_id=country_id, timestamp__gte=start, timestamp__lte=end
+            )
+            .order_by("timestamp")
+            .values_list("timestamp", "value")
+        )
+        times = np.fromiter((row[0].timestamp() for row in rows), float, len(rows))
+        values = np.fromiter((row[1] for row in rows), float, len(rows))
+        kept = downsample(times, values, points, method)
+
+        return JsonResponse(
+            {
+                "zone": zone,
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "method": method,
+                "source_points": len(rows),
+                "series": [
+                    [rows[index][0].isoformat(), rows[index][1]]
+                    for index in kept.tolist()
+                ],
+            }
+        )
+
+    @staticmethod
+    def series_params(params):
+        """
+        Parse and validate the query string, raising ``ValueError`` with a
+        message for the client.
+        """
+        zone = params.get("zone", "").strip()
+        if not zone:
+            raise ValueError("A zone is required.")
+
+        end = parse_time(params, "end") or timezone.now()
+        start = parse_time(params, "start") or end - timedelta(
+            hours=settings.REALTIME_SERIES_DEFAULT_HOURS
+        )
+        if start >= end:
+            raise ValueError("start must be before end.")
+
+        try:
+            points = int(params.get("points", settings.REALTIME_SERIES_POINTS))
+        except ValueError:
+            raise ValueError("points must be an integer.")
+        if not 3 <= points <= settings.REALTIME_SERIES_MAX_POINTS:
+            raise ValueError(
+                f"points must be between 3 and {settings.REALTIME_SERIES_MAX_POINTS}."
+            )
+
+        method = params.get("method", "lttb")
+        if method not in METHODS:
+            raise ValueError(f"Unsupported method, use one of {list(METHODS)}.")
+        return zone, start, end, points, method
+
+
+def parse_time(params, name: str):
+    """
+    Parse the ISO 8601 time ``name`` of ``params`` as an aware datetime
+    (UTC if it has no offset), or ``None`` if it is not given.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError(f"{name} must be an ISO 8601 datetime.")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+def realtime_buffer_metrics(request: HttpRequest) -> JsonResponse:
+    """
+    Report the depth of the realtime write-behind buffer and the latency of
+    its last flush.
+    """
+    return JsonResponse(buffer_metrics())
+
+
+def upstream_health(request: HttpRequest) -> JsonResponse:
+    """
+    Report the ElectricityMap circuit breaker state, the number of
+    short-circuited calls and the retry budget usage.
+    """
+    return JsonResponse(upstream_metrics())
+
+
 class CountryListView(View):
     """
     View to fetch all unique regions.
     """
 
+    query_budget = 1
+
     def get(self, request, *args, **kwargs):
-        countries = Country.objects.values("name").distinct()
-        return JsonResponse(list(countries), safe=False)
+        return catalog_response(request, "countries")
 
 
 class SectorListView(View):
@@ -65,9 +222,10 @@ class SectorListView(View):
     View to fetch all unique sectors.
     """
 
+    query_budget = 1
+
     def get(self, request, *args, **kwargs):
-        sectors = Sector.objects.values("name").distinct()
-        return JsonResponse(list(sectors), safe=False)
+        return catalog_response(request, "sectors")
 
 
 class SubstanceListView(View):
@@ -75,56 +233,181 @@ class SubstanceListView(View):
     View to fetch all unique substances.
     """
 
+    query_budget = 1
+
+    def get(self, request, *args, **kwargs):
+        return catalog_response(request, "substances")
+
+
+class CatalogView(View):
+    """
+    View to fetch the ids and names (and codes of countries) of all
+    countries, sectors and substances at once.
+    """
+
+    query_budget = 3
+
+    def get(self, request, *args, **kwargs):
+        return catalog_response(request, "catalog")
+
+
+class HistoricalCoverageView(View):
+    """
+    List the first and last year and the number of records available per
+    country, sector and substance.
+    """
+
+    query_budget = 1
+
     def get(self, request, *args, **kwargs):
-        substances = Substance.objects.values("name").distinct()
-        return JsonResponse(list(substances), safe=False)
+        coverage = cached_response("coverage", {}, self.coverage_rows)
+        return JsonResponse(coverage, safe=False)
+
+    @staticmethod
+    def coverage_rows() -> list[dict]:
+        rows = HistoricalCoverage.objects.order_by(
+            "country__name", "sector__name", "substance__name"
+        ).values_list(
+            "country__name",
+            "country__code",
+            "sector__name",
+            "substance__name",
+            "first_year",
+            "last_year",
+            "rows",
+        )
+        return [dict(zip(COVERAGE_FIELDS, row)) for row in rows]
 
 
 class FilteredEnvironmentalDataView(ListAPIView):
     """
     Fetch historical environmental data with support for filtering by
-    country, sector, substance, and year range. Defaults to the
-    most recent year if no range is provided.
+    country, sector, substance, and year range. Unpaginated requests
+    default to the most recent year if no range is provided, and all
+    requests to the ``HISTORICAL_DEFAULT_SUBSTANCE`` if no substance is.
     """
 
     queryset = HistoricalEnvironmentalRecord.objects.all()
     serializer_class = HistoricalEnvironmentalRecordSerializer
-    filter_backends = [DjangoFilterBackend]
-    filterset_class = HistoricalDataFilter
+    most_recent_year_by_default = True
+    # Country and sector ids on a cold dimension cache, the coverage index,
+    # then the records.
+    query_budget = 4
 
     def list(self, request, *args, **kwargs):
         """
-        Overrides the list method to group data by country and their
-        respective sectors. Includes an "All" value for the total of
-        all sectors per country.
-        """
-
-        queryset = self.get_queryset()
+        Serve the response data for the request filters from the response
+        cache, building it on a miss.
 
-        if not queryset.exists():
-            return Response(
-                {"error": "No data found for the provided filters."}, status=404
-            )
+        The ETag is derived from the dataset generation and the filters, so
+        a client that already has the current response gets a 304 without
+        any query on the records.
+        """
+        namespace, params = type(self).__name__, self.cache_params()
+        etag = response_etag(namespace, params)
+        modified = last_modified()
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = Response(cached_response(namespace, params, self.response_data))
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(modified)
+        return response
+
+    def response_data(self) -> dict:
+        """
+        Group the data by country and their respective sectors. Requests
+        with a ``cursor`` or ``page_size`` get one keyset page, and so do
+        unpaginated requests matching more than ``HISTORICAL_PAGE_SIZE_MAX``
+        values, which get the first page of that size.
+        """
+        if self.paginated():
+            return self.page_data()
+
+        limit = settings.HISTORICAL_PAGE_SIZE_MAX
+        snapshot = load_snapshot()
+        if snapshot is not None:
+            rows = self.snapshot_rows(snapshot)
+            if len(rows) > limit:
+                return self.page_data(limit)
+            return snapshot.grouped(rows)
+
+        self.check_coverage()
+        rows = (
+            self.get_queryset()
+            .order_by("-year")
+            .values_list("country__name", "sector__name", "year", "value")[: limit + 1]
+        )
 
         response_data = {}
-        for record in queryset:
-            country_name = record.country.name
-            sector_name = record.sector.name
-            year = record.year
-            value = record.value
-
-            if country_name not in response_data:
-                response_data[country_name] = {}
+        for count, (country_name, sector_name, year, value) in enumerate(
+            rows.iterator(chunk_size=ROW_CHUNK_SIZE)
+        ):
+            if count == limit:
+                return self.page_data(limit)
+            response_data.setdefault(country_name, {}).setdefault(sector_name, {})[
+                year
+            ] = value
+
+        return self.found(response_data)
+
+    def page_data(self, size=None) -> dict:
+        """
+        Return one page of the filtered records ordered by year (most recent
+        first), country and sector, with the cursor of the next page.
+        ``size`` defaults to the requested page size.
+        """
+        params = self.request.query_params
+        self.check_coverage()
+        rows, next_cursor = keyset_page(
+            self.get_queryset(),
+            ["country__name", "sector__name", "value"],
+            size or page_size(params.get("page_size")),
+            params.get("cursor"),
+        )
+        if not rows and not params.get("cursor"):
+            raise NotFound("No data found for the provided filters.")
 
-            if sector_name not in response_data[country_name]:
-                response_data[country_name][sector_name] = {}
+        results = {}
+        for year, _, _, _, country_name, sector_name, value in rows:
+            results.setdefault(country_name, {}).setdefault(sector_name, {})[
+                year
+            ] = value
+        return {"results": results, "next": next_cursor}
 
-            response_data[country_name][sector_name][year] = value
+    def paginated(self) -> bool:
+        params = self.request.query_params
+        return "cursor" in params or "page_size" in params
 
-        return Response(response_data)
+    @staticmethod
+    def found(response_data: dict) -> dict:
+        if not response_data:
+            raise NotFound("No data found for the provided filters.")
+        return response_data
 
-    def get_queryset(self):
-        queryset = super().get_queryset()
+    def cache_params(self) -> dict:
+        """
+        Normalize the request filters into the response cache key. Country
+        and sector names match exactly, so only their order and duplicates
+        are normalized; the substance matches case-insensitively and is
+        case-folded.
+        """
+        country_names, sectors, start_year, end_year = self.filter_params()
+        params = self.request.query_params
+        return {
+            "country": sorted(set(country_names)),
+            "sector": sorted(set(sectors)),
+            "start_year": start_year,
+            "end_year": end_year,
+            "substance": self.substance_filter(),
+            "cursor": params.get("cursor"),
+            "page_size": params.get("page_size"),
+        }
+
+    def filter_params(self):
+        """
+        Parse the country names, sectors and year range from the query string.
+        The year range only applies when both bounds are given.
+        """
         filter_data = self.request.query_params
 
         country_names = filter_data.get("country", "").split(",")
@@ -132,19 +415,148 @@ class FilteredEnvironmentalDataView(ListAPIView):
         start_year = filter_data.get("start_year")
         end_year = filter_data.get("end_year")
 
-        if country_names and country_names != [""]:
-            queryset = queryset.filter(country__name__in=country_names)
-
+        if country_names == [""]:
+            country_names = []
         sectors = [sector.strip() for sector in sectors if sector.strip()]
+        if not (start_year and end_year):
+            start_year = end_year = None
+
+        return country_names, sectors, start_year, end_year
+
+    def default_substance(self):
+        """
+        Substance of the records when the request names none. Responses are
+        keyed by country, sector and year only, so values of several
+        substances would overwrite each other.
+        """
+        return settings.HISTORICAL_DEFAULT_SUBSTANCE
+
+    def substance_filter(self):
+        """
+        Return the case-folded ``substance`` filter, falling back to
+        ``default_substance``. Substances match case-insensitively.
+        """
+        substance = self.request.query_params.get("substance", "").strip()
+        return (substance or self.default_substance() or "").casefold() or None
+
+    def snapshot_rows(self, snapshot):
+        """
+        Select the snapshot rows matching the request filters.
+        """
+        country_names, sectors, start_year, end_year = self.filter_params()
+        rows = snapshot.select(
+            country_names=country_names,
+            sectors=sectors,
+            substance=self.substance_filter(),
+            start_year=start_year,
+            end_year=end_year,
+        )
+        if not len(rows):
+            raise NotFound("No data found for the provided filters.")
+        if self.defaults_to_most_recent_year():
+            years = snapshot.year[rows]
+            rows = rows[years == years.max()]
+        return rows
+
+    @cached_property
+    def filter_ids(self):
+        """
+        Resolve the country and sector filters to ids, ``None`` for a filter
+        that is not given.
+        """
+        country_names, sectors, _, _ = self.filter_params()
+        country_ids = sector_ids = None
+        if country_names:
+            country_ids = list(
+                dimensions.countries_by_name.get_many(
+                    country_names, create=False
+                ).values()
+            )
         if sectors:
-            queryset = queryset.filter(sector__name__in=sectors)
+            sector_ids = list(
+                dimensions.sectors.get_many(sectors, create=False).values()
+            )
+        return country_ids, sector_ids
 
-        if start_year and end_year:
-            queryset = queryset.filter(year__gte=start_year, year__lte=end_year)
+    def defaults_to_most_recent_year(self) -> bool:
+        """
+        Whether the response is limited to the most recent year because it
+        is unpaginated and has no complete year range.
+        """
+        _, _, start_year, end_year = self.filter_params()
+        return (
+            self.most_recent_year_by_default
+            and not (start_year and end_year)
+            and not self.paginated()
+        )
+
+    @cached_property
+    def year_range(self):
+        """
+        Return the requested year range or, when defaulting to the most
+        recent year, that year as both bounds. The year is looked up in the
+        coverage index, which raises ``NotFound`` if no record matches.
+        """
+        _, _, start_year, end_year = self.filter_params()
+        if not self.defaults_to_most_recent_year():
+            return start_year, end_year
+
+        country_ids, sector_ids = self.filter_ids
+        year = most_recent_year(
+            covering(country_ids, sector_ids, self.substance_filter())
+        )
+        if year is None:
+            raise NotFound("No data found for the provided filters.")
+        return year, year
 
-        if not queryset.exists():
+    def check_coverage(self):
+        """
+        Raise ``NotFound`` when the coverage index shows that no record
+        matches the request filters, so the records are never read.
+        """
+        if self.defaults_to_most_recent_year():
+            # Resolving the year already consulted the coverage index.
+            self.year_range
+            return
+        country_names, sectors, start_year, end_year = self.filter_params()
+        substance = self.substance_filter()
+        if not (
+            country_names
+            or sectors
+            or self.request.query_params.get("substance")
+            or start_year
+        ):
+            return
+        country_ids, sector_ids = self.filter_ids
+        if country_ids == [] or sector_ids == []:
+            raise NotFound("No data found for the provided filters.")
+        if not is_covered(country_ids, sector_ids, start_year, end_year, substance):
             raise NotFound("No data found for the provided filters.")
 
+    def get_queryset(self):
+        return self.apply_filters(super().get_queryset())
+
+    def apply_filters(self, queryset):
+        """
+        Restrict a queryset with country, sector, substance and year fields
+        to the request filters.
+        """
+        start_year, end_year = self.year_range
+        country_ids, sector_ids = self.filter_ids
+        substance = self.substance_filter()
+
+        if substance:
+            queryset = queryset.filter(substance__name__iexact=substance)
+
+        if country_ids is not None:
+            queryset = queryset.filter(country_id__in=country_ids)
+
+        if sector_ids is not None:
+            queryset = queryset.filter(sector_id__in=sector_ids)
+
+        if start_year and end_year:
+            queryset = queryset.filter(year__gte=start_year, year__lte=end_year)
+
         return queryset
 
 
@@ -153,34 +565,127 @@ class CountryTotalDataView(FilteredEnvironmentalDataView):
     Fetch total values grouped by country and year.
     """
 
-    def list(self, request, *args, **kwargs):
+    # Totals are charted over all years.
+    most_recent_year_by_default = False
+
+    def default_substance(self):
+        # Totals add up all substances unless one is requested.
+        return None
+
+    def response_data(self) -> dict:
         """
-        Overrides the list method to group data by country and their respective sectors.
-        Includes an "All" value for the total of all sectors per country.
+        Sum the values per country and year. Totals over all sectors are read
+        from the ``CountryYearTotal`` rollup. Sector-filtered totals are
+        summed from the snapshot if there is one, otherwise in the database.
         """
 
-        queryset = self.get_queryset()
+        _, sectors, _, _ = self.filter_params()
+        if not sectors:
+            self.check_coverage()
+            queryset = self.apply_filters(CountryYearTotal.objects.all())
+            field = "total"
+        else:
+            snapshot = load_snapshot()
+            if snapshot is not None:
+                return snapshot.totals(self.snapshot_rows(snapshot))
+            self.check_coverage()
+            queryset = self.get_queryset()
+            field = "value"
+
+        # Totals of different substances are added up, as before the rollup.
+        rows = (
+            queryset.order_by("country__name", "-year")
+            .values_list("country__name", "year")
+            .annotate(sum_total=Sum(field))
+        )
+        response_data = {}
+        for country_name, year, total in rows.iterator(chunk_size=ROW_CHUNK_SIZE):
+            response_data.setdefault(country_name, {"Total": {}})["Total"][year] = total
 
-        if not queryset.exists():
-            return Response(
-                {"error": "No data found for the provided filters."}, status=404
-            )
+        return self.found(response_data)
+
+
+class LineBuffer:
+    """
+    File-like object that hands back what ``csv.writer`` writes to it.
+    """
+
+    def write(self, value):
+        return value
 
-        response_data = {}
-        for record in queryset:
-            country_name = record.country.name
-            year = record.year
-            value = record.value
 
-            if country_name not in response_data:
-                response_data[country_name] = {}
+class HistoricalExportView(View):
+    """
+    Stream historical records as NDJSON (default) or CSV, filtered with
+    ``HistoricalDataFilter``.
 
-            if "Total" not in response_data[country_name]:
-                response_data[country_name]["Total"] = {}
+    Rows are read with a server-side iterator in the order of the natural
+    key index, so the database needs no sort, the first rows are sent
+    before the query finishes and memory stays constant.
+    """
 
-            if year not in response_data[country_name]["Total"]:
-                response_data[country_name]["Total"][year] = 0
+    query_budget = 1
 
-            response_data[country_name]["Total"][year] += value
+    def get(self, request, *args, **kwargs):
+        output = request.GET.get("format", "ndjson")
+        if output not in EXPORT_FORMATS:
+            return JsonResponse(
+                {"error": f"Unsupported format, use one of {sorted(EXPORT_FORMATS)}."},
+                status=400,
+            )
 
-        return Response(response_data)
+        filterset = HistoricalDataFilter(
+            request.GET, queryset=HistoricalEnvironmentalRecord.objects.all()
+        )
+        if not filterset.is_valid():
+            return JsonResponse(filterset.errors, status=400)
+
+        rows = (
+            filterset.qs.order_by("country_id", "sector_id", "substance_id", "year")
+            .values_list(
+                "country__code",
+                "country__name",
+                "sector__name",
+                "substance__name",
+                "year",
+                "value",
+            )
+            .iterator(chunk_size=ROW_CHUNK_SIZE)
+        )
+        lines = self.csv_lines(rows) if output == "csv" else self.ndjson_lines(rows)
+        response = StreamingHttpResponse(
+            self.batched(lines), content_type=EXPORT_FORMATS[output]
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="historical_environmental_data.{output}"'
+        )
+        return response
+
+    @staticmethod
+    def csv_lines(rows):
+        writer = csv.writer(LineBuffer())
+        yield writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            yield writer.writerow(row)
+
+    @staticmethod
+    def ndjson_lines(rows):
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n"
+
+    @staticmethod
+    def batched(lines, size=1000):
+        """
+        Join lines into chunks of ``size`` to cut per-write overhead. The
+        first line goes out on its own, as soon as it is ready.
+        """
+        lines = iter(lines)
+        yield next(lines, "")
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) == size:
+                yield "".join(batch)
+                batch = []
+        if batch:
+            yield "".join(batch)